@@ -0,0 +1,24 @@
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.image_utils import ImageUtils
+
+# Outline rasterization: legacy 8-offset loop vs single-pass stroke.
+#   python benchmarks/bench_text.py
+
+def bench(style, scale, repeat=20):
+    utils = ImageUtils()
+    tx = {"text": "EPIC THUMBNAIL", "font_size": 120, "bold": 6, "color": "#ffcc00", "outline": style}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        utils.text_cache.clear()
+        utils.text_sprite(tx, scale)
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    for label, scale in (("preview", 1), ("export 2x", 2)):
+        offset = bench("offset", scale)
+        stroke = bench("stroke", scale)
+        print(f"{label:10s} offset {offset:7.2f} ms   stroke {stroke:7.2f} ms   speedup {offset / stroke:4.1f}x")
+
+if __name__ == "__main__":
+    main()
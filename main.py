@@ -1,12 +1,23 @@
 import os, threading, json, time
+from concurrent.futures import ThreadPoolExecutor
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
+from PIL import ImageTk
 from tools.textpanel import TextPanel
 from tools.layermanager import LayerManager
 from tools.protools import ProTools
 from utils.image_utils import ImageUtils
 from utils.autosave import AutoSaver
+from utils.compositor import Compositor, DragPlanes
+from utils.scheduler import RenderScheduler
+from utils.scene import Scene
+from utils.layers import OverlayLayer
+from utils.history import History
+from utils.exporter import ExportJob, ExportCancelled, EXPORT_TARGETS, targets_for, target_path
+from utils.project import PROJECT_EXT, save_project, load_project, prefetch
+from utils.loader import open_image, file_loader
+from utils.imagestore import ImageStore
+from utils.spatial import SpatialIndex
 
 class ProThumbnailStudio(ctk.CTk):
     def __init__(self):
@@ -36,18 +47,35 @@ class ProThumbnailStudio(ctk.CTk):
         self.configure(fg_color=self.theme["fg"])
 
         self.background = None
+        self.background_path = None
+        self.background_asset = None
         self.overlays = []
         self.text_layers = []
         self.selected_layer = None
 
         self.image_utils = ImageUtils()
+        self.compositor = Compositor(self.image_utils)
+        self.spatial = SpatialIndex(self.image_utils)
+        self._bg_tk = None
+        self._canvas_item = None
+        self._drag = None
+        self.render_scheduler = RenderScheduler(self, self._render_preview, self._present_preview)
         self.autosaver = AutoSaver(self)
         self.project_path = None
+        self.project_file = None
+        self._asset_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="assets")
+        self._export_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+        self._export = None
+        self.image_store = ImageStore()
         self._overlay_tks = {}
         self._preview_ratio = 1.0
         self.snap_enabled = True
 
+        self.history = History(self)
         self.build_ui()
+        self.bind_all("<Control-z>", self.undo)
+        self.bind_all("<Control-y>", self.redo)
+        self.bind_all("<Control-Shift-Z>", self.redo)
         self.update_canvas()
 
         self.autosaver.start_autosave_loop()
@@ -65,6 +93,9 @@ class ProThumbnailStudio(ctk.CTk):
         self.canvas_frame.grid(row=0, column=1, sticky="nswe", pady=10)
         self.canvas = ctk.CTkCanvas(self.canvas_frame, bg=self.theme["fg"], highlightthickness=0)
         self.canvas.pack(fill="both", expand=True, padx=10, pady=10)
+        self.canvas.bind("<ButtonPress-1>", self.start_drag)
+        self.canvas.bind("<B1-Motion>", self.drag_layer)
+        self.canvas.bind("<ButtonRelease-1>", self.end_drag)
 
         self.build_left_sidebar()
         self.text_panel = TextPanel(self.sidebar_left, self)
@@ -84,6 +115,14 @@ class ProThumbnailStudio(ctk.CTk):
                       command=self.load_background).pack(pady=5, fill="x")
         ctk.CTkButton(self.sidebar_left, text="Add Overlay PNG", fg_color=self.theme["accent"],
                       command=self.add_overlay).pack(pady=5, fill="x")
+        ctk.CTkButton(self.sidebar_left, text="Open Project", fg_color=self.theme["accent"],
+                      command=self.open_project_file).pack(pady=5, fill="x")
+        ctk.CTkButton(self.sidebar_left, text="Save Project", fg_color=self.theme["accent"],
+                      command=self.save_project_file).pack(pady=5, fill="x")
+        history_row = ctk.CTkFrame(self.sidebar_left, fg_color="transparent")
+        history_row.pack(pady=5, fill="x")
+        ctk.CTkButton(history_row, text="Undo", width=60, fg_color="#444", command=self.undo).pack(side="left", expand=True, fill="x", padx=(0, 2))
+        ctk.CTkButton(history_row, text="Redo", width=60, fg_color="#444", command=self.redo).pack(side="left", expand=True, fill="x", padx=(2, 0))
         ctk.CTkButton(self.sidebar_left, text="Open Pro Tools", fg_color=self.theme["accent"],
                       command=self.open_protools).pack(pady=5, fill="x")
         ctk.CTkButton(self.sidebar_left, text="Export", fg_color=self.theme["accent"],
@@ -104,26 +143,157 @@ class ProThumbnailStudio(ctk.CTk):
         path = filedialog.askopenfilename(title="Select Background", filetypes=[("Images", "*.jpg *.png *.jpeg")])
         if not path:
             return
-        self.background = Image.open(path).convert("RGB")
+        # Decoded off the Tk thread; JPEGs come back as a draft preview with the full decode queued.
+        future = self._asset_pool.submit(open_image, path, "RGB")
+        self._when_done([future], lambda futures: self._set_background(path, future))
+
+    def _set_background(self, path, future):
+        try:
+            img = future.result()
+        except Exception as e:
+            messagebox.showerror("Load Background", str(e))
+            return
+        self.background = img
+        self.background_path = path
+        self.background_asset = None
         self.project_path = os.path.dirname(path)
+        self.image_store.set_background(img.size)
         self.layer_manager.refresh_layers()
         self.update_canvas()
+        self._await_assets(prefetch(Scene(img), self._asset_pool))
 
     def add_overlay(self):
-        path = filedialog.askopenfilename(title="Select Overlay", filetypes=[("Images", "*.png *.jpg")])
+        paths = filedialog.askopenfilenames(title="Select Overlays", filetypes=[("Images", "*.png *.jpg *.jpeg")])
+        if not paths:
+            return
+        # Files decode concurrently; layers are added in selection order as they arrive.
+        jobs = [(i, path, self._asset_pool.submit(self._load_overlay, path)) for i, path in enumerate(paths)]
+        self._import_overlays(jobs)
+
+    def _load_overlay(self, path):
+        # Asset pool: decode, orient and cap one file; full resolution stays reloadable from it.
+        return self.image_store.adopt(open_image(path, "RGBA"), loader=file_loader(path, "RGBA"))
+
+    def _prepare(self, img):
+        # Asset pool: cap the image to what exports can use, decoding it in full only when they need it all.
+        img = self.image_store.adopt(img)
+        if self.image_store.pending(img):
+            img.image()
+        return img
+
+    def _import_overlays(self, jobs):
+        added = []
+        while jobs and jobs[0][2].done():
+            i, path, future = jobs.pop(0)
+            try:
+                img = future.result()
+            except Exception as e:
+                messagebox.showerror("Add Overlay", f"{os.path.basename(path)}: {e}")
+                continue
+            offset = 20 * (i % 10)
+            ov = OverlayLayer(image=img, x=100 + offset, y=100 + offset, name=os.path.basename(path), path=path)
+            self.overlays.append(ov)
+            added.append(ov)
+        if added:
+            self.layer_manager.refresh_layers()
+            self.update_canvas()
+            self._await_assets([self._asset_pool.submit(self._prepare, ov["image"]) for ov in added])
+        if jobs:
+            self.after(30, lambda: self._import_overlays(jobs))
+
+    def save_project_file(self):
+        if not self.background:
+            messagebox.showinfo("Save Project", "Load a background first.")
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=PROJECT_EXT,
+            filetypes=[("Thumbnail Project", "*" + PROJECT_EXT)],
+            initialfile=os.path.basename(self.project_file or "Untitled" + PROJECT_EXT)
+        )
         if not path:
             return
-        img = Image.open(path).convert("RGBA")
-        ov = {"image": img, "x": 100, "y": 100, "scale": 1.0, "angle": 0, "visible": True, "locked": False, "name": os.path.basename(path)}
-        self.overlays.append(ov)
-        self.layer_manager.refresh_layers()
-        self.update_canvas()
-
-    def update_canvas(self):
-        self.canvas.delete("all")
+        try:
+            save_project(path, self, theme=self.theme_name)
+        except Exception as e:
+            messagebox.showerror("Save Project", str(e))
+            return
+        self.project_file = path
 
+    def open_project_file(self):
+        path = filedialog.askopenfilename(title="Open Project", filetypes=[("Thumbnail Project", "*" + PROJECT_EXT)])
+        if not path:
+            return
+        try:
+            scene, state = load_project(path)
+        except Exception as e:
+            messagebox.showerror("Open Project", str(e))
+            return
+        self.background = scene.background
+        self.background_path = scene.background_path
+        self.background_asset = (state.get("background") or {}).get("asset")
+        self.overlays = scene.overlays
+        self.text_layers = scene.text_layers
+        self.selected_layer = None
+        self.project_file = path
+        self.project_path = os.path.dirname(path)
+        self.image_store.set_background(self.background.size if self.background else None)
+        if state.get("theme") in self.supported_themes:
+            self.change_theme(state["theme"])
+        self.layer_manager.refresh_layers()
+        self.text_panel.refresh_layer_list()
+        self.history.reset()
+        # Layers show their proxies at once; redraw when the full-resolution pixels are in.
+        self.update_canvas(full=True)
+        self._await_assets(prefetch(Scene(scene.background), self._asset_pool) +
+                           [self._asset_pool.submit(self._prepare, ov["image"]) for ov in scene.overlays])
+
+    def _await_assets(self, futures):
+        if futures:
+            self._when_done(futures, lambda futures: (self.update_canvas(full=True), self.enforce_budget()))
+
+    def enforce_budget(self):
+        future = self._asset_pool.submit(self.image_store.enforce)
+        self._when_done([future], lambda futures: self.layer_manager.update_memory())
+
+    def _when_done(self, futures, callback):
+        # Polled from the Tk thread so the callback can touch widgets.
+        if all(f.done() for f in futures):
+            callback(futures)
+        else:
+            self.after(50, lambda: self._when_done(futures, callback))
+
+    def undo(self, event=None):
+        if not self._drag and self.history.undo():
+            self._after_history()
+
+    def redo(self, event=None):
+        if not self._drag and self.history.redo():
+            self._after_history()
+
+    def _after_history(self):
+        # Drop references to layers the restored state no longer contains.
+        layers = self.overlays + self.text_layers
+        if not any(self.selected_layer is l for l in layers):
+            self.selected_layer = None
+        panel = self.text_panel
+        if not any(panel.current_layer is l for l in self.text_layers):
+            panel.current_layer = None
+        self.layer_manager.refresh_layers()
+        panel.refresh_layer_list()
+        panel.update_panel_from_layer()
+        self.image_store.set_background(self.background.size if self.background else None)
+        self.update_canvas(full=True)
+
+    def update_canvas(self, full=False):
+        # Every scene mutation ends in a redraw, so this is where edits are recorded.
+        self.history.commit()
         # When no background is loaded
         if not self.background:
+            self.canvas.delete("all")
+            self._bg_tk = None
+            self._canvas_item = None
+            # Lets the render worker drop its cached frame
+            self.render_scheduler.submit(Scene.snapshot(self), 1.0)
             # Measure only the visible canvas area (excluding sidebar)
             self.canvas.update_idletasks()
             cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
@@ -163,25 +333,107 @@ class ProThumbnailStudio(ctk.CTk):
             self.animate_fade_text()
             return
 
-        # Draw composed scene when background exists
-        composed = self.image_utils.compose_scene(self)
-        if not composed:
-            return
-
+        # Compose straight at preview size on the render worker; full resolution is only used for export
         cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
-        w, h = composed.size
+        w, h = self.background.size
         ratio = min(cw / w, ch / h, 1.0)
         self._preview_ratio = ratio
-        display = composed.resize((int(w * ratio), int(h * ratio)))
+        self.render_scheduler.submit(Scene.snapshot(self), ratio, full)
+
+    def _render_preview(self, scene, ratio, full=False):
+        # Runs on the render worker thread
+        if full:
+            self.compositor.reset()
+        frame, dirty = self.compositor.render(scene, ratio)
+        if frame is None:
+            return None
+        if dirty is None:
+            return frame.copy(), None
+        if dirty[2] <= dirty[0] or dirty[3] <= dirty[1]:
+            return None
+        return frame.crop(dirty), dirty
+
+    def _present_preview(self, result):
+        display, dirty = result
+        if not self.background or self._drag:
+            return
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if dirty is not None:
+            if not self._bg_tk:
+                return
+            self._blit(display, dirty)
+            self.canvas.coords(self._canvas_item, *self.canvas_origin())
+            return
+
+        self.canvas.delete("all")
         self._bg_tk = ImageTk.PhotoImage(display)
         # Always anchor relative to the canvas (not global window)
-        self.canvas.create_image(
+        self._canvas_item = self.canvas.create_image(
             cw // 2 - display.width // 2,
             ch // 2 - display.height // 2,
             anchor="nw",
             image=self._bg_tk
         )
 
+    def _blit(self, patch, box):
+        # Only push the changed rectangle into the existing PhotoImage
+        patch_tk = ImageTk.PhotoImage(patch)
+        self.canvas.tk.call(str(self._bg_tk), "copy", str(patch_tk), "-to", box[0], box[1])
+
+    def canvas_origin(self):
+        # Canvas position of the preview's top-left corner; the preview is centred.
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        return cw // 2 - self._bg_tk.width() // 2, ch // 2 - self._bg_tk.height() // 2
+
+    def start_drag(self, event):
+        if not self.background or not self._bg_tk:
+            return
+        ratio = self._preview_ratio
+        # A click on a layer's visible pixels selects it; elsewhere the selection is dragged.
+        ox, oy = self.canvas_origin()
+        self.spatial.sync(self)
+        picked = self.spatial.hit((event.x - ox) / ratio, (event.y - oy) / ratio)
+        if picked is not None and picked is not self.selected_layer:
+            self.layer_manager.select_layer(picked, "TX" if picked in self.text_layers else "OV")
+        layer = self.selected_layer
+        if not layer or layer.get("locked"):
+            return
+        try:
+            planes = DragPlanes(self.image_utils, Scene.snapshot(self), id(layer), ratio)
+        except ValueError:
+            return
+        self._drag = {"layer": layer, "planes": planes, "start": (event.x, event.y),
+                      "origin": (layer["x"], layer["y"]), "sprite_pos": planes.pos}
+
+    def drag_layer(self, event):
+        if not self._drag:
+            return
+        d = self._drag
+        ratio = self._preview_ratio
+        dx, dy = event.x - d["start"][0], event.y - d["start"][1]
+        x, y = int(d["origin"][0] + dx / ratio), int(d["origin"][1] + dy / ratio)
+        if self.snap_enabled:
+            # The snap distance is in screen pixels, whatever the zoom.
+            x, y = self.image_utils.snap_position(self.spatial, d["layer"], x, y, self.image_utils.snap_distance / ratio)
+            self.image_utils.draw_snap_guides(self.canvas, ratio, self.canvas_origin())
+        d["layer"]["x"], d["layer"]["y"] = x, y
+        self.spatial.update(d["layer"])
+        # Move the cached sprite by the same preview-space offset the layer moved.
+        shift_x = int(d["layer"]["x"] * ratio) - int(d["origin"][0] * ratio)
+        shift_y = int(d["layer"]["y"] * ratio) - int(d["origin"][1] * ratio)
+        patch, box = d["planes"].move((d["sprite_pos"][0] + shift_x, d["sprite_pos"][1] + shift_y))
+        if patch is not None:
+            self._blit(patch, box)
+
+    def end_drag(self, event):
+        if not self._drag:
+            return
+        self._drag = None
+        self.image_utils.snap_lines = []
+        self.canvas.delete("snap")
+        self.update_canvas(full=True)
+        self.history.seal()
+
     def animate_fade_text(self, alpha=0):
         try:
             text_item = self.canvas.find_withtag("fadeText")
@@ -207,19 +459,67 @@ class ProThumbnailStudio(ctk.CTk):
         if not self.background:
             messagebox.showinfo("Export", "Load a background first.")
             return
+        if self._export:
+            self._export["window"].lift()
+            return
         export_path = filedialog.asksaveasfilename(
+            title="Export (every format is written next to this file)",
             defaultextension=".jpg",
-            filetypes=[("JPEG", "*.jpg"), ("PNG", "*.png")],
+            filetypes=[("JPEG", "*.jpg"), ("PNG", "*.png"), ("WebP", "*.webp")],
             initialfile="Thumbnail_Export.jpg"
         )
         if not export_path:
             return
-        final_img = self.image_utils.compose_scene(self, upscale=True)
-        final_img.save(export_path)
-        messagebox.showinfo("Export", f"Saved: {os.path.basename(export_path)}")
+        targets = targets_for(export_path, EXPORT_TARGETS)
+        names = "\n".join(os.path.basename(target_path(export_path, t)) for t in targets)
+        if not messagebox.askokcancel("Export", f"These files will be written to {os.path.dirname(export_path)}:\n{names}"):
+            return
+        # The snapshot keeps the export consistent while editing continues.
+        job = ExportJob(self.image_utils, Scene.snapshot(self), export_path, targets)
+        win = ctk.CTkToplevel(self)
+        win.title("Export")
+        win.geometry("360x140")
+        win.configure(fg_color=self.theme["sidebar"])
+        label = ctk.CTkLabel(win, text="Starting...", text_color=self.theme["text"])
+        label.pack(pady=(15, 5))
+        bar = ctk.CTkProgressBar(win)
+        bar.set(0)
+        bar.pack(fill="x", padx=20, pady=5)
+        ctk.CTkButton(win, text="Cancel", fg_color="#444", command=job.cancel).pack(pady=10)
+        win.protocol("WM_DELETE_WINDOW", job.cancel)
+        self._export = {"job": job, "future": self._export_pool.submit(job.run), "window": win,
+                        "label": label, "bar": bar}
+        self._poll_export()
+
+    def _poll_export(self):
+        e = self._export
+        job, future = e["job"], e["future"]
+        if not future.done():
+            e["label"].configure(text="Cancelling..." if job.cancelled else job.status)
+            e["bar"].set(job.progress)
+            self.after(100, self._poll_export)
+            return
+        e["window"].destroy()
+        self._export = None
+        try:
+            outputs = future.result()
+        except ExportCancelled:
+            return
+        except Exception as ex:
+            messagebox.showerror("Export", str(ex))
+            return
+        messagebox.showinfo("Export", "Saved:\n" + "\n".join(outputs))
 
     def on_close(self):
         self.autosaver.stop()
+        self.render_scheduler.stop()
+        self.protools.shutdown()
+        self.layer_manager.shutdown()
+        self._asset_pool.shutdown(wait=False, cancel_futures=True)
+        if self._export:
+            self._export["job"].cancel()
+        self._export_pool.shutdown(wait=True)
+        self.image_store.close()
         self.destroy()
 
 if __name__ == "__main__":
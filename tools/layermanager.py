@@ -1,102 +1,238 @@
 import customtkinter as ctk
 from tkinter import messagebox
+from PIL import Image
+from utils.cache import LRUCache
+from utils.project import LazyImage
+from utils.scheduler import RenderScheduler
+
+# The panel is virtualized: a fixed pool of row widgets, just enough to fill the visible
+# area, is re-bound to whichever layers are scrolled into view. refresh_layers() only
+# rebuilds the cheap entry list and index map; a row's widgets are reconfigured when the
+# entry it shows actually changed. Thumbnails are rendered on a worker thread.
+
+ROW_HEIGHT = 36
+THUMB_SIZE = (40, 26)
 
 class LayerManager(ctk.CTkFrame):
     def __init__(self, parent, app):
         super().__init__(parent, corner_radius=10)
         self.app = app
         self.layers_ui = []
+        self.row_keys = []
+        self.entries = []
+        self.index = {}
+        self.top = 0
         self.fg_color = app.theme["sidebar"]
         self.text_color = app.theme["text"]
+        self.thumbs = LRUCache(max_bytes=4 * 1024 * 1024, sizeof=lambda im: THUMB_SIZE[0] * THUMB_SIZE[1] * 4)
+        self.thumb_scheduler = RenderScheduler(self, self._render_thumbs, self._present_thumbs, name="thumbnails")
+        self._blank = ctk.CTkImage(Image.new("RGBA", THUMB_SIZE, (0, 0, 0, 0)), size=THUMB_SIZE)
         self.pack(fill="both", expand=True, pady=(10, 10))
         self.build_panel()
 
     def build_panel(self):
         ctk.CTkLabel(self, text="Layer Manager", text_color=self.text_color).pack(pady=(5, 5))
-        self.scroll_frame = ctk.CTkScrollableFrame(self, fg_color=self.fg_color)
-        self.scroll_frame.pack(fill="both", expand=True, padx=5, pady=5)
+        body = ctk.CTkFrame(self, fg_color="transparent")
+        body.pack(fill="both", expand=True, padx=5, pady=5)
+        self.scrollbar = ctk.CTkScrollbar(body, command=self.scroll)
+        self.scrollbar.pack(side="right", fill="y")
+        self.list_frame = ctk.CTkFrame(body, fg_color=self.fg_color)
+        self.list_frame.pack(side="left", fill="both", expand=True)
+        self.list_frame.pack_propagate(False)
+        self.list_frame.bind("<Configure>", lambda e: self.resize_pool(e.height))
+        self.bind_wheel(self.list_frame)
+        self.memory_label = ctk.CTkLabel(self, text="", text_color=self.text_color)
+        self.memory_label.pack(pady=(0, 5))
+        self.resize_pool(10 * ROW_HEIGHT)
         self.refresh_layers()
 
-    def refresh_layers(self):
-        for w in self.scroll_frame.winfo_children():
-            w.destroy()
+    def bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self.scroll("scroll", -1 if e.delta > 0 else 1, "units"))
+        widget.bind("<Button-4>", lambda e: self.scroll("scroll", -1, "units"))
+        widget.bind("<Button-5>", lambda e: self.scroll("scroll", 1, "units"))
 
-        self.layers_ui.clear()
-        idx = 0
+    def resize_pool(self, height):
+        count = max(1, height // ROW_HEIGHT + 1)
+        while len(self.layers_ui) < count:
+            self.layers_ui.append(self.add_layer_row(len(self.layers_ui)))
+            self.row_keys.append(None)
+        while len(self.layers_ui) > count:
+            self.layers_ui.pop()["frame"].destroy()
+            self.row_keys.pop()
+        self.render_rows()
 
-        if self.app.background:
-            self.add_layer_row("Background", "BG", idx)
-            idx += 1
+    def add_layer_row(self, slot):
+        row = ctk.CTkFrame(self.list_frame, fg_color="#222", corner_radius=5, height=ROW_HEIGHT - 4)
+        row.pack_propagate(False)
 
-        for i, ov in enumerate(self.app.overlays):
-            self.add_layer_row(ov.get("name", f"Overlay {i+1}"), "OV", idx, layer_obj=ov)
-            idx += 1
+        thumb = ctk.CTkLabel(row, text="", image=self._blank, width=THUMB_SIZE[0])
+        thumb.pack(side="left", padx=(4, 2))
 
-        for i, tx in enumerate(self.app.text_layers):
-            self.add_layer_row(f"Text {i+1}", "TX", idx, layer_obj=tx)
-            idx += 1
-
-    def add_layer_row(self, name, typ, index, layer_obj=None):
-        row = ctk.CTkFrame(self.scroll_frame, fg_color="#222" if typ != "BG" else "#333", corner_radius=5)
-        row.pack(fill="x", pady=3, padx=4)
-
-        lbl = ctk.CTkLabel(row, text=name, width=140, anchor="w", text_color="white")
-        lbl.pack(side="left", padx=5)
+        lbl = ctk.CTkLabel(row, text="", width=100, anchor="w", text_color="white")
+        lbl.pack(side="left", padx=3)
 
         eye = ctk.CTkButton(row, text="👁️", width=30, fg_color="#555",
-                            command=lambda obj=layer_obj: self.toggle_visibility(obj))
+                            command=lambda: self.toggle_visibility(self.row_layer(slot)))
         eye.pack(side="left", padx=2)
 
         lock = ctk.CTkButton(row, text="🔒", width=30, fg_color="#555",
-                             command=lambda obj=layer_obj: self.toggle_lock(obj))
+                             command=lambda: self.toggle_lock(self.row_layer(slot)))
         lock.pack(side="left", padx=2)
 
-        up_btn = ctk.CTkButton(row, text="↑", width=25, command=lambda obj=layer_obj: self.move_up(obj))
+        up_btn = ctk.CTkButton(row, text="↑", width=25, command=lambda: self.move_up(self.row_layer(slot)))
         up_btn.pack(side="left", padx=1)
-        down_btn = ctk.CTkButton(row, text="↓", width=25, command=lambda obj=layer_obj: self.move_down(obj))
+        down_btn = ctk.CTkButton(row, text="↓", width=25, command=lambda: self.move_down(self.row_layer(slot)))
         down_btn.pack(side="left", padx=1)
 
-        select_btn = ctk.CTkButton(row, text="Select", width=60, fg_color=self.app.theme["accent"],
-                                   command=lambda obj=layer_obj, tp=typ: self.select_layer(obj, tp))
+        select_btn = ctk.CTkButton(row, text="Select", width=50, fg_color=self.app.theme["accent"],
+                                   command=lambda: self.select_row(slot))
         select_btn.pack(side="right", padx=3)
 
-        self.layers_ui.append(row)
+        for widget in (row, thumb, lbl):
+            self.bind_wheel(widget)
+        return {"frame": row, "thumb": thumb, "label": lbl, "eye": eye, "lock": lock}
+
+    def refresh_layers(self):
+        # (type, name, layer) per row, bottom to top, and where each layer sits in its list.
+        entries = []
+        if self.app.background:
+            entries.append(("BG", "Background", None))
+        for i, ov in enumerate(self.app.overlays):
+            entries.append(("OV", ov.get("name") or f"Overlay {i+1}", ov))
+        for i, tx in enumerate(self.app.text_layers):
+            entries.append(("TX", f"Text {i+1}", tx))
+        self.entries = entries
+        self.index = {id(ov): ("overlays", i) for i, ov in enumerate(self.app.overlays)}
+        self.index.update((id(tx), ("text_layers", i)) for i, tx in enumerate(self.app.text_layers))
+        # Cached thumbnails keep their image alive (so its id is not reused); let go of
+        # those whose image left the scene.
+        live = {id(self.app.background)} | {id(ov["image"]) for ov in self.app.overlays}
+        self.thumbs.invalidate(lambda k: k[0] != "TX" and k[1] not in live)
+        self.render_rows()
+        self.update_memory()
+
+    def update_memory(self):
+        report = self.app.image_store.report(self.app)
+        mb = 1024 * 1024
+        self.memory_label.configure(text=f"Images: {report['resident'] / mb:.0f} of {report['budget'] / mb:.0f} MB"
+                                         f" in RAM, {report['mapped'] / mb:.0f} MB on disk")
+
+    def thumb_key(self, typ, layer):
+        if typ == "BG":
+            return ("BG", id(self.app.background))
+        if typ == "OV":
+            return ("OV", id(layer["image"]))
+        # Text thumbnails depend on what is written and how, not on where.
+        return ("TX", layer.get("text"), layer.get("font"), layer.get("font_size"), layer.get("bold"),
+                layer.get("color"), layer.get("outline"))
+
+    def render_rows(self):
+        visible = len(self.layers_ui)
+        self.top = max(0, min(self.top, len(self.entries) - visible + 1))
+        missing = []
+        for slot, ui in enumerate(self.layers_ui):
+            i = self.top + slot
+            if i >= len(self.entries):
+                if self.row_keys[slot] is not None:
+                    ui["frame"].pack_forget()
+                    self.row_keys[slot] = None
+                continue
+            typ, name, layer = self.entries[i]
+            tkey = self.thumb_key(typ, layer)
+            photo = self.thumbs.get(tkey)
+            if photo is None:
+                source = self.app.background if typ == "BG" else layer["image"] if typ == "OV" else layer.copy()
+                missing.append((tkey, typ, source))
+            key = (typ, name, id(layer), layer.get("visible", True) if layer else True,
+                   layer.get("locked", False) if layer else False, tkey if photo else None)
+            if key == self.row_keys[slot]:
+                continue
+            if self.row_keys[slot] is None:
+                ui["frame"].pack(fill="x", pady=2, padx=4)
+            self.row_keys[slot] = key
+            ui["frame"].configure(fg_color="#333" if typ == "BG" else "#222")
+            ui["label"].configure(text=name)
+            ui["thumb"].configure(image=photo or self._blank)
+            ui["eye"].configure(fg_color="#555" if key[3] else "#333")
+            ui["lock"].configure(fg_color="#a55" if key[4] else "#555")
+        if missing:
+            self.thumb_scheduler.submit(missing)
+        n = max(1, len(self.entries))
+        self.scrollbar.set(self.top / n, min(1.0, (self.top + visible) / n))
+
+    def scroll(self, action, amount, unit=None):
+        visible = len(self.layers_ui)
+        if action == "moveto":
+            self.top = int(float(amount) * len(self.entries))
+        elif unit == "pages":
+            self.top += int(amount) * max(1, visible - 1)
+        else:
+            self.top += int(amount)
+        self.render_rows()
+
+    def _render_thumbs(self, jobs):
+        # Runs on the thumbnail thread; only small copies leave it.
+        out = {}
+        for key, typ, source in jobs:
+            owner = None if typ == "TX" else source
+            if typ == "TX":
+                if not source.get("text"):
+                    out[key] = (Image.new("RGBA", (1, 1), (0, 0, 0, 0)), None)
+                    continue
+                source, _ = self.app.image_utils.text_sprite(source, 2 * THUMB_SIZE[1] / max(1, source["font_size"]))
+            elif isinstance(source, LazyImage):
+                source, _ = source.source_for(THUMB_SIZE[0] / source.width)
+            r = min(THUMB_SIZE[0] / source.width, THUMB_SIZE[1] / source.height)
+            size = (max(1, int(source.width * r)), max(1, int(source.height * r)))
+            out[key] = (source.resize(size, Image.BILINEAR, reducing_gap=2.0), owner)
+        return out
+
+    def _present_thumbs(self, thumbs):
+        for key, (img, owner) in thumbs.items():
+            self.thumbs.put(key, ctk.CTkImage(img, size=img.size), owner=owner)
+        self.render_rows()
+
+    def row_layer(self, slot):
+        i = self.top + slot
+        return self.entries[i][2] if i < len(self.entries) else None
 
     def toggle_visibility(self, obj):
         if not obj: return
         if "visible" in obj:
             obj["visible"] = not obj["visible"]
+            self.render_rows()
             self.app.update_canvas()
 
     def toggle_lock(self, obj):
         if not obj: return
         if "locked" in obj:
             obj["locked"] = not obj["locked"]
+            self.render_rows()
+            self.app.update_canvas()
+
+    def move(self, obj, step):
+        # Swaps obj with its neighbour in its own list; the index map replaces list scans.
+        if obj is None or id(obj) not in self.index:
+            return
+        kind, i = self.index[id(obj)]
+        layers = getattr(self.app, kind)
+        j = i + step
+        if 0 <= j < len(layers) and layers[i] is obj:
+            layers[i], layers[j] = layers[j], layers[i]
+            self.refresh_layers()
             self.app.update_canvas()
 
     def move_up(self, obj):
-        if obj in self.app.overlays:
-            i = self.app.overlays.index(obj)
-            if i < len(self.app.overlays) - 1:
-                self.app.overlays[i], self.app.overlays[i+1] = self.app.overlays[i+1], self.app.overlays[i]
-        elif obj in self.app.text_layers:
-            i = self.app.text_layers.index(obj)
-            if i < len(self.app.text_layers) - 1:
-                self.app.text_layers[i], self.app.text_layers[i+1] = self.app.text_layers[i+1], self.app.text_layers[i]
-        self.refresh_layers()
-        self.app.update_canvas()
+        self.move(obj, 1)
 
     def move_down(self, obj):
-        if obj in self.app.overlays:
-            i = self.app.overlays.index(obj)
-            if i > 0:
-                self.app.overlays[i], self.app.overlays[i-1] = self.app.overlays[i-1], self.app.overlays[i]
-        elif obj in self.app.text_layers:
-            i = self.app.text_layers.index(obj)
-            if i > 0:
-                self.app.text_layers[i], self.app.text_layers[i-1] = self.app.text_layers[i-1], self.app.text_layers[i]
-        self.refresh_layers()
-        self.app.update_canvas()
+        self.move(obj, -1)
+
+    def select_row(self, slot):
+        i = self.top + slot
+        if i < len(self.entries):
+            typ, _, layer = self.entries[i]
+            self.select_layer(layer, typ)
 
     def select_layer(self, obj, typ):
         if typ == "TX":
@@ -109,4 +245,7 @@ class LayerManager(ctk.CTkFrame):
         self.fg_color = theme["sidebar"]
         self.text_color = theme["text"]
         self.configure(fg_color=self.fg_color)
-        self.scroll_frame.configure(fg_color=self.fg_color)
+        self.list_frame.configure(fg_color=self.fg_color)
+
+    def shutdown(self):
+        self.thumb_scheduler.stop()
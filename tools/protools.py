@@ -1,12 +1,11 @@
 import customtkinter as ctk
 from tkinter import messagebox
-from PIL import Image, ImageEnhance, ImageFilter, ImageTk
-import io, threading, numpy as np, cv2
-try:
-    from rembg import remove as rembg_remove
-    REMBG_AVAILABLE = True
-except Exception:
-    REMBG_AVAILABLE = False
+from PIL import ImageTk
+from concurrent.futures import ThreadPoolExecutor
+from utils.scheduler import RenderScheduler
+from utils.adjust import PRESETS, compile_adjustments, gray_histogram, render_presets
+from utils.project import realize
+from utils.rembg_worker import BackgroundRemover, AVAILABLE as REMBG_AVAILABLE
 
 class ProTools:
     def __init__(self, app):
@@ -16,6 +15,19 @@ class ProTools:
         self.working_image = None
         self.use_gpu = False
         self.current_preset = None
+        self.scheduler = None
+        self.refine_delay = 400
+        self._refine_job = None
+        self._refine_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="protools-refine")
+        self._full_key = None
+        self._full_future = None
+        self._hist_source = None
+        self._histogram = None
+        self._thumb_key = None
+        self._thumbs = None
+        self.thumb_size = (80, 50)
+        self.remover = BackgroundRemover()
+        self.rembg_scheduler = None
 
     def update_theme(self, theme):
         self.theme = theme
@@ -44,6 +56,14 @@ class ProTools:
         self.preview_canvas = ctk.CTkCanvas(self.right, bg=self.theme["fg"], highlightthickness=0)
         self.preview_canvas.pack(fill="both", expand=True)
 
+        if self.scheduler:
+            self.scheduler.stop()
+        self.scheduler = RenderScheduler(self.window, self._render_preview, self._present_preview, name="protools")
+        if self.rembg_scheduler:
+            self.rembg_scheduler.stop()
+        self.rembg_scheduler = RenderScheduler(self.window, self._remove_background, self._present_rembg, name="rembg")
+        self.window.protocol("WM_DELETE_WINDOW", self.close_window)
+
         self.build_controls()
         self.load_working_image()
 
@@ -62,11 +82,31 @@ class ProTools:
                           command=lambda n=name: self.apply_preset(n)).pack(pady=3)
 
         ctk.CTkSwitch(self.left, text="Use GPU (OpenCV)", command=self.toggle_gpu).pack(pady=(15,10))
-        ctk.CTkButton(self.left, text="Remove Background", fg_color="#e91e63",
-                      command=self.remove_background_thread).pack(pady=(10,5), fill="x")
+        self.rembg_button = ctk.CTkButton(self.left, text="Remove Background", fg_color="#e91e63",
+                      command=self.remove_background_thread)
+        self.rembg_button.pack(pady=(10,5), fill="x")
         ctk.CTkButton(self.left, text="Apply Changes", fg_color=self.theme["accent"],
                       command=self.apply_to_main).pack(pady=(15,5), fill="x")
-        ctk.CTkButton(self.left, text="Close", command=self.window.destroy).pack(pady=5, fill="x")
+        ctk.CTkButton(self.left, text="Close", command=self.close_window).pack(pady=5, fill="x")
+
+    def close_window(self):
+        self.cancel_refine()
+        if self.scheduler:
+            self.scheduler.stop()
+            self.scheduler = None
+        if self.rembg_scheduler:
+            self.rembg_scheduler.stop()
+            self.rembg_scheduler = None
+        # Nothing full-resolution outlives the window.
+        self.working_image = None
+        self._full_key = self._full_future = None
+        self._hist_source = self._histogram = None
+        self._thumbs = self._thumb_key = None
+        self.window.destroy()
+
+    def shutdown(self):
+        self._refine_pool.shutdown(wait=False, cancel_futures=True)
+        self.remover.stop()
 
     def make_slider(self, name, from_, to, start):
         s = ctk.CTkSlider(self.left, from_=from_, to=to, number_of_steps=100, command=lambda v=None:self.update_preview())
@@ -80,13 +120,16 @@ class ProTools:
         frame.pack(pady=5)
         ctk.CTkLabel(frame, text="Preview Thumbnails", text_color=self.theme["text"]).pack()
         self.thumb_labels = []
-        for i in range(5):
-            l = ctk.CTkLabel(frame, text=f"#{i+1}", width=50)
+        self._shown_thumbs = None
+        for name in PRESETS:
+            l = ctk.CTkLabel(frame, text=name, width=50, compound="top", text_color=self.theme["text"])
             l.pack(side="left", padx=2, pady=2)
+            l.bind("<Button-1>", lambda e, n=name: self.apply_preset(n))
             self.thumb_labels.append(l)
 
     def load_working_image(self):
-        self.working_image = self.app.background.copy()
+        # Filters never draw on their input, so the background itself is the working image.
+        self.working_image = realize(self.app.background)
         self.update_preview()
 
     def toggle_gpu(self):
@@ -94,58 +137,101 @@ class ProTools:
         self.update_preview()
 
     def update_preview(self):
-        if not self.working_image: return
-        img = self.apply_filters(self.working_image)
+        if not self.working_image or not self.scheduler: return
         w, h = self.preview_canvas.winfo_width(), self.preview_canvas.winfo_height()
         if w < 10 or h < 10: return
+        # Slider values are read here on the Tk thread; filtering runs on the worker.
+        params = self.filter_params()
+        self.scheduler.submit(self.working_image, params, (w, h))
+        self.schedule_refine()
+
+    def _render_preview(self, img, params, size):
+        # Interactive feedback filters a display-sized proxy, never the full image.
+        w, h = size
         r = min(w/img.width, h/img.height, 1.0)
-        disp = img.resize((int(img.width*r), int(img.height*r)))
+        proxy = self.app.image_utils.pyramid(img).resized((max(1, int(img.width*r)), max(1, int(img.height*r))))
+        b, c, col, s, bl, use_gpu = params
+        disp = self.apply_filters(proxy, (b, c, col, s, bl * r, use_gpu), self.histogram_for(img))
+        return disp, self.render_thumbnails(img), size
+
+    def schedule_refine(self):
+        # Full-resolution pass once the sliders have been still for refine_delay ms.
+        self.cancel_refine()
+        self._refine_job = self.window.after(self.refine_delay, self.start_refine)
+
+    def cancel_refine(self):
+        if self._refine_job and self.window:
+            try:
+                self.window.after_cancel(self._refine_job)
+            except Exception:
+                pass
+        self._refine_job = None
+
+    def start_refine(self):
+        self._refine_job = None
+        key = (id(self.working_image), self.filter_params())
+        if key == self._full_key:
+            return
+        if self._full_future:
+            self._full_future.cancel()
+        self._full_key = key
+        self._full_future = self._refine_pool.submit(self.apply_filters, self.working_image, key[1])
+
+    def full_result(self):
+        key = (id(self.working_image), self.filter_params())
+        if key == self._full_key and self._full_future and not self._full_future.cancelled():
+            return self._full_future.result()
+        return self.apply_filters(self.working_image, key[1])
+
+    def _present_preview(self, result):
+        disp, thumbs, (w, h) = result
+        if not self.window or not self.window.winfo_exists(): return
         tk = ImageTk.PhotoImage(disp)
         self.preview_canvas.delete("all")
         self.preview_canvas.create_image((w - disp.width)//2, (h - disp.height)//2, anchor="nw", image=tk)
         self.preview_canvas._tkimg = tk
-        self.update_thumbnails(img)
-
-    def apply_filters(self, img):
-        if self.use_gpu:
-            arr = np.array(img)
-            if arr.ndim == 3:
-                if self.blur.get() > 0:
-                    arr = cv2.GaussianBlur(arr, (0,0), self.blur.get())
-                arr = cv2.convertScaleAbs(arr, alpha=self.contrast.get(), beta=0)
-            img = Image.fromarray(arr)
-        else:
-            img = ImageEnhance.Brightness(img).enhance(self.brightness.get())
-            img = ImageEnhance.Contrast(img).enhance(self.contrast.get())
-            img = ImageEnhance.Color(img).enhance(self.color.get())
-            img = ImageEnhance.Sharpness(img).enhance(self.sharp.get())
-            if self.blur.get() > 0:
-                img = img.filter(ImageFilter.GaussianBlur(radius=self.blur.get()))
-        return img
-
-    def update_thumbnails(self, base_img):
+        self.update_thumbnails(thumbs)
+
+    def filter_params(self):
+        return (self.brightness.get(), self.contrast.get(), self.color.get(),
+                self.sharp.get(), self.blur.get(), self.use_gpu)
+
+    def histogram_for(self, img):
+        # Contrast pivots on the full image's mean, so proxy and full-res passes agree.
+        if self._hist_source is not img:
+            self._histogram = gray_histogram(img)
+            self._hist_source = img
+        return self._histogram
+
+    def apply_filters(self, img, params=None, histogram=None):
+        b, c, col, s, bl, use_gpu = params or self.filter_params()
+        kernel = compile_adjustments(b, c, col, s, bl, histogram or self.histogram_for(img))
+        return kernel.apply(img, use_opencv=use_gpu)
+
+    def render_thumbnails(self, source):
+        # Presets previewed on the unfiltered source from one shared downscale,
+        # cached until the source or the preset definitions change.
+        key = (id(source), source.size, tuple(PRESETS.items()))
+        if key != self._thumb_key:
+            base = self.app.image_utils.pyramid(source).resized(self.thumb_size)
+            thumbs = render_presets(base, self.histogram_for(source), blur_scale=self.thumb_size[0] / source.width)
+            self._thumbs, self._thumb_key = list(thumbs.values()), key
+        return self._thumbs
+
+    def update_thumbnails(self, thumbs):
+        if thumbs is self._shown_thumbs: return
         try:
-            thumbs = []
-            for i in range(5):
-                factor = 0.5 + i * 0.25
-                img = base_img.copy().resize((80, 50))
-                img = ImageEnhance.Contrast(img).enhance(factor)
+            for i, img in enumerate(thumbs):
                 tki = ImageTk.PhotoImage(img)
-                self.thumb_labels[i].configure(image=tki, text="")
+                self.thumb_labels[i].configure(image=tki)
                 self.thumb_labels[i].image = tki
+            self._shown_thumbs = thumbs
         except:
             pass
 
     def apply_preset(self, name):
-        presets = {
-            "Cinematic": (1.1, 1.4, 0.8, 2.0, 1.0),
-            "Bright": (1.4, 1.2, 1.2, 1.0, 0.0),
-            "Gaming": (1.2, 1.5, 1.3, 2.5, 0.0),
-            "Warm": (1.1, 1.0, 1.5, 1.5, 0.0),
-            "Cold": (0.9, 1.3, 0.7, 1.5, 0.0)
-        }
-        if name in presets:
-            b, c, col, s, bl = presets[name]
+        if name in PRESETS:
+            b, c, col, s, bl = PRESETS[name]
             self.brightness.set(b)
             self.contrast.set(c)
             self.color.set(col)
@@ -158,22 +244,31 @@ class ProTools:
         if not REMBG_AVAILABLE:
             messagebox.showinfo("rembg", "Please install rembg to use this feature.")
             return
-        threading.Thread(target=self._do_rembg, daemon=True).start()
-
-    def _do_rembg(self):
-        img = self.working_image
-        messagebox.showinfo("Background Removal", "Removing background... please wait.")
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        data = rembg_remove(buf.getvalue())
-        out = Image.open(io.BytesIO(data)).convert("RGBA")
+        self.rembg_button.configure(state="disabled", text="Removing background...")
+        self.rembg_scheduler.submit(self.working_image)
+
+    def _remove_background(self, img):
+        # Runs on the rembg scheduler thread; the model itself lives in the worker process.
+        try:
+            return self.remover.remove(img), None
+        except Exception as e:
+            return None, str(e)
+
+    def _present_rembg(self, result):
+        out, error = result
+        self.rembg_button.configure(state="normal", text="Remove Background")
+        if error:
+            messagebox.showerror("Background Removal", error)
+            return
         self.working_image = out
         self.update_preview()
-        messagebox.showinfo("Done", "Background removed successfully.")
 
     def apply_to_main(self):
         if not self.working_image: return
-        img = self.apply_filters(self.working_image)
+        self.cancel_refine()
+        # Reuses the background full-resolution pass when it matches the current sliders.
+        img = self.full_result()
         self.app.background = img.convert("RGB")
+        self.app.background_asset = None
         self.app.update_canvas()
         messagebox.showinfo("Pro Tools", "Edits applied successfully.")
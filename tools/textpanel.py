@@ -1,13 +1,12 @@
 import customtkinter as ctk
-from tkinter import colorchooser, messagebox
+from tkinter import colorchooser
 from PIL import ImageFont
-import copy
+from utils.layers import TextLayer
 
 class TextPanel(ctk.CTkFrame):
     def __init__(self, parent, app):
         super().__init__(parent, corner_radius=10)
         self.app = app
-        self.text_history = []
         self.current_layer = None
         self.fg_color = app.theme["sidebar"]
         self.text_color = app.theme["text"]
@@ -20,9 +19,7 @@ class TextPanel(ctk.CTkFrame):
         self.layer_box.pack(fill="x", pady=(0, 5))
 
         ctk.CTkButton(self, text="Add Text Layer", fg_color=self.app.theme["accent"],
-                      command=self.add_text_layer).pack(pady=(5, 5), fill="x")
-        ctk.CTkButton(self, text="Undo Text", fg_color="#444",
-                      command=self.undo_text).pack(pady=(0, 10), fill="x")
+                      command=self.add_text_layer).pack(pady=(5, 10), fill="x")
 
         self.text_entry = ctk.CTkEntry(self, placeholder_text="Enter text here")
         self.text_entry.pack(fill="x", pady=3)
@@ -38,6 +35,11 @@ class TextPanel(ctk.CTkFrame):
         self.bold_slider.pack(fill="x", pady=(5, 3))
         ctk.CTkLabel(self, text="Boldness", text_color=self.text_color).pack(pady=(0, 5))
 
+        self.outline_box = ctk.CTkOptionMenu(self, values=["Stroke", "Offset"], command=self.update_outline_style)
+        self.outline_box.set("Stroke")
+        self.outline_box.pack(fill="x", pady=(5, 3))
+        ctk.CTkLabel(self, text="Outline Style", text_color=self.text_color).pack(pady=(0, 5))
+
         self.color_button = ctk.CTkButton(self, text="Pick Color", command=self.pick_color)
         self.color_button.pack(pady=(5, 10), fill="x")
 
@@ -50,17 +52,7 @@ class TextPanel(ctk.CTkFrame):
         ctk.CTkButton(move_frame, text="→", width=40, command=lambda: self.move_text(10, 0)).grid(row=1, column=2)
 
     def add_text_layer(self):
-        layer = {
-            "text": "New Text",
-            "font_size": 80,
-            "bold": 2,
-            "color": "white",
-            "x": 200,
-            "y": 300,
-            "visible": True,
-            "locked": False
-        }
-        self.push_history()
+        layer = TextLayer(text="New Text", x=200, y=300)
         self.app.text_layers.append(layer)
         self.current_layer = layer
         self.refresh_layer_list()
@@ -86,20 +78,22 @@ class TextPanel(ctk.CTkFrame):
 
     def update_text_content(self):
         if not self.current_layer: return
-        self.push_history()
         self.current_layer["text"] = self.text_entry.get()
         self.app.update_canvas()
 
     def update_text_style(self, val=None):
         if not self.current_layer: return
-        self.push_history()
         self.current_layer["font_size"] = int(self.font_slider.get())
         self.current_layer["bold"] = int(self.bold_slider.get())
         self.app.update_canvas()
 
+    def update_outline_style(self, name):
+        if not self.current_layer: return
+        self.current_layer["outline"] = name.lower()
+        self.app.update_canvas()
+
     def pick_color(self):
         if not self.current_layer: return
-        self.push_history()
         color = colorchooser.askcolor()[1]
         if color:
             self.current_layer["color"] = color
@@ -107,34 +101,17 @@ class TextPanel(ctk.CTkFrame):
 
     def move_text(self, dx, dy):
         if not self.current_layer: return
-        self.push_history()
         self.current_layer["x"] += dx
         self.current_layer["y"] += dy
         self.app.update_canvas()
 
-    def push_history(self):
-        snap = copy.deepcopy(self.app.text_layers)
-        self.text_history.append(snap)
-        if len(self.text_history) > 15:
-            self.text_history.pop(0)
-
-    def undo_text(self):
-        if not self.text_history:
-            messagebox.showinfo("Undo", "No undo history.")
-            return
-        state = self.text_history.pop()
-        self.app.text_layers = copy.deepcopy(state)
-        self.current_layer = self.app.text_layers[-1] if self.app.text_layers else None
-        self.refresh_layer_list()
-        self.app.layer_manager.refresh_layers()
-        self.app.update_canvas()
-
     def update_panel_from_layer(self):
         if not self.current_layer: return
         self.text_entry.delete(0, "end")
         self.text_entry.insert(0, self.current_layer["text"])
         self.font_slider.set(self.current_layer["font_size"])
         self.bold_slider.set(self.current_layer["bold"])
+        self.outline_box.set(self.current_layer.get("outline", "stroke").capitalize())
 
     def update_theme(self, theme):
         self.fg_color = theme["sidebar"]
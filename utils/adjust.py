@@ -0,0 +1,137 @@
+from PIL import Image
+import numpy as np, cv2
+
+# Fused brightness / contrast / color / sharpness / blur.
+#
+# Brightness, contrast and color are point operations, so they fold into one set of
+# lookup tables applied in a single pass. With color == 1 that is a plain 8-bit LUT per
+# channel; otherwise each output channel is P[v] + LR[r] + LG[g] + LB[b] in 6-bit fixed
+# point (which always fits int16). Point and sharpen stages run together over cache-sized
+# row bands; blur is one Gaussian pass. Every step is integer exact, so the NumPy and
+# OpenCV paths give identical pixels.
+
+PRESETS = {
+    "Cinematic": (1.1, 1.4, 0.8, 2.0, 1.0),
+    "Bright": (1.4, 1.2, 1.2, 1.0, 0.0),
+    "Gaming": (1.2, 1.5, 1.3, 2.5, 0.0),
+    "Warm": (1.1, 1.0, 1.5, 1.5, 0.0),
+    "Cold": (0.9, 1.3, 0.7, 1.5, 0.0)
+}
+
+FIXED_BITS = 6
+FIXED_ONE = 1 << FIXED_BITS
+# ITU-R 601-2 luma, as used by Image.convert("L") and ImageEnhance.Color
+LUMA = (0.299, 0.587, 0.114)
+# ImageFilter.SMOOTH, which ImageEnhance.Sharpness blends against
+SMOOTH = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32)
+
+class FusedAdjustment:
+    def __init__(self, brightness, contrast, color, sharpness, blur, mean):
+        self.sharpness = sharpness
+        self.blur = blur
+        levels = np.arange(256, dtype=np.float64)
+        # Brightness then contrast, per channel, truncated the way ImageEnhance's blend does.
+        levels = np.floor(np.clip(levels * brightness, 0, 255))
+        levels = np.floor(np.clip(mean + contrast * (levels - mean), 0, 255))
+        if color == 1.0:
+            self.lut = levels.astype(np.uint8)
+            self.luma_luts = None
+        else:
+            # color mixes each channel with the luma of the contrast-adjusted pixel
+            self.lut = np.rint(color * levels * FIXED_ONE).astype(np.int16)
+            self.luma_luts = [np.rint((1 - color) * w * levels * FIXED_ONE).astype(np.int16) for w in LUMA]
+
+    @property
+    def is_identity(self):
+        return (self.luma_luts is None and np.array_equal(self.lut, np.arange(256))
+                and self.sharpness == 1.0 and self.blur <= 0)
+
+    def apply(self, img, use_opencv=False, band=64):
+        if self.is_identity:
+            return img.copy()
+        alpha = img.getchannel("A") if img.mode == "RGBA" else None
+        arr = np.asarray(img.convert("RGB"))
+        h = arr.shape[0]
+        out = np.empty_like(arr)
+        for y0 in range(0, h, band):
+            y1 = min(h, y0 + band)
+            if self.sharpness == 1.0:
+                out[y0:y1] = self.point(arr[y0:y1], use_opencv)
+                continue
+            # One row of context above and below for the 3x3 sharpen.
+            top, bottom = max(0, y0 - 1), min(h, y1 + 1)
+            chunk = self.sharpen(self.point(arr[top:bottom], use_opencv), use_opencv)
+            out[y0:y1] = chunk[y0 - top:y0 - top + (y1 - y0)]
+        if self.blur > 0:
+            out = cv2.GaussianBlur(out, (0, 0), self.blur)
+        out = Image.fromarray(out, "RGB")
+        if alpha is not None:
+            out.putalpha(alpha)
+        return out
+
+    def point(self, arr, use_opencv):
+        if self.luma_luts is None:
+            if use_opencv:
+                return cv2.LUT(arr, self.lut)
+            return self.lut[arr]
+        if use_opencv:
+            acc = cv2.LUT(arr, np.repeat(self.lut, 3).reshape(256, 1, 3))
+            gray = cv2.LUT(arr[..., 0].copy(), self.luma_luts[0])
+            gray = cv2.add(gray, cv2.LUT(arr[..., 1].copy(), self.luma_luts[1]))
+            gray = cv2.add(gray, cv2.LUT(arr[..., 2].copy(), self.luma_luts[2]))
+        else:
+            acc = self.lut[arr]
+            gray = self.luma_luts[0][arr[..., 0]]
+            gray += self.luma_luts[1][arr[..., 1]]
+            gray += self.luma_luts[2][arr[..., 2]]
+        acc += gray[..., None]
+        acc += FIXED_ONE // 2
+        acc >>= FIXED_BITS
+        return np.clip(acc, 0, 255).astype(np.uint8)
+
+    def sharpen(self, arr, use_opencv):
+        # Exact integer neighbourhood sums (edges replicated) ...
+        if use_opencv:
+            sums = cv2.filter2D(arr, cv2.CV_32F, SMOOTH, borderType=cv2.BORDER_REPLICATE)
+        else:
+            # Separable 3x3 box sum plus 4x the centre, in int16.
+            p = np.pad(arr, ((1, 1), (1, 1), (0, 0)), mode="edge").astype(np.int16)
+            rows = p[:, :-2] + p[:, 1:-1]
+            rows += p[:, 2:]
+            box = rows[:-2] + rows[1:-1]
+            box += rows[2:]
+            box += arr * np.int16(4)
+            sums = box.astype(np.float32)
+        # ... then the same blend with the smoothed image on both paths.
+        sums *= np.float32((1 - self.sharpness) / 13)
+        sums += arr * np.float32(self.sharpness)
+        np.rint(sums, out=sums)
+        return np.clip(sums, 0, 255).astype(np.uint8)
+
+def render_presets(base, histogram, names=None, blur_scale=1.0):
+    # Each preset applied to one shared (small) base image. The contrast mean comes from
+    # the full-size source's histogram and blur radii are scaled to the base's size, so
+    # the thumbnails look like a downscaled copy of the full-resolution result.
+    thumbs = {}
+    for name in names or PRESETS:
+        kernel = compile_preset(name, histogram)
+        kernel.blur *= blur_scale
+        thumbs[name] = kernel.apply(base)
+    return thumbs
+
+def gray_histogram(img):
+    return img.convert("L").histogram()[:256]
+
+def mean_after_brightness(histogram, brightness):
+    # Mean luma ImageEnhance.Contrast would measure after the brightness step.
+    levels = np.floor(np.clip(np.arange(256) * brightness, 0, 255))
+    hist = np.asarray(histogram, dtype=np.float64)
+    total = hist.sum()
+    return int(float((hist * levels).sum()) / total + 0.5) if total else 0
+
+def compile_adjustments(brightness, contrast, color, sharpness, blur, histogram):
+    return FusedAdjustment(brightness, contrast, color, sharpness, blur,
+                           mean_after_brightness(histogram, brightness))
+
+def compile_preset(name, histogram):
+    return compile_adjustments(*PRESETS[name], histogram)
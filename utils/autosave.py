@@ -1,78 +1,217 @@
-import os, json, threading, time
+import os, json
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+from utils.project import LazyImage, AssetStore
+from utils.loader import lazy_file, decode_full
+from utils.layers import OverlayLayer, TextLayer
+from utils.scene import scene_version
+
+# Autosave is driven by layer revisions (utils/layers.py): a scene whose version has not
+# moved is never written, and entries of unchanged layers are reused instead of rebuilt.
+# The state is snapshotted on the Tk thread and encoded and written on a single writer
+# thread. Small edits are appended to a journal as per-layer deltas; the
+# base file is rewritten (atomically) once the journal grows.
+
+def write_atomic(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def diff_state(old, new):
+    # Top-level values and individual list entries that changed, plus list lengths.
+    delta = {}
+    for key, value in new.items():
+        if isinstance(value, list) and isinstance(old.get(key), list):
+            prev = old[key]
+            changed = {str(i): v for i, v in enumerate(value) if i >= len(prev) or prev[i] != v}
+            if changed or len(prev) != len(value):
+                delta[key] = {"len": len(value), "set": changed}
+        elif old.get(key) != value:
+            delta[key] = {"value": value}
+    return delta
+
+def apply_delta(state, delta):
+    for key, change in delta.items():
+        if "value" in change:
+            state[key] = change["value"]
+            continue
+        items = state.setdefault(key, [])
+        del items[change["len"]:]
+        items.extend([None] * (change["len"] - len(items)))
+        for i, v in change["set"].items():
+            items[int(i)] = v
+    return state
 
 class AutoSaver:
     def __init__(self, app):
         self.app = app
         self.running = False
         self.interval = 30
-        self.thread = None
+        self.max_journal = 50
         self.autosave_path = os.path.join(os.getcwd(), ".ytproj_autosave.json")
+        self.journal_path = self.autosave_path + ".journal"
+        self._job = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autosave")
+        self._saved_version = None
+        self._sequence = 0
+        self._entries = {}
+        self._base = None
+        self._last = None
+        self._journal_lines = 0
 
     def start_autosave_loop(self):
         if self.running: return
         self.running = True
-        self.thread = threading.Thread(target=self._loop, daemon=True)
-        self.thread.start()
+        # Whatever is on screen when the loop starts counts as already saved.
+        self._saved_version = self.version()
+        self._job = self.app.after(self.interval * 1000, self._tick)
 
-    def _loop(self):
-        while self.running:
-            time.sleep(self.interval)
-            try:
-                self.save_state()
-            except Exception as e:
-                print("Autosave error:", e)
+    def _tick(self):
+        if not self.running: return
+        try:
+            self.save_state()
+        except Exception as e:
+            print("Autosave error:", e)
+        self._job = self.app.after(self.interval * 1000, self._tick)
 
-    def save_state(self):
+    def version(self):
+        app = self.app
+        return (scene_version(app), app.theme_name, app.background_path, app.background_asset, app.project_path)
+
+    def snapshot(self):
+        # Tk thread only: a consistent copy of everything that gets saved.
         data = {
-            "background_path": self.app.project_path,
+            "background_path": self.app.background_path,
+            "background_asset": self.app.background_asset,
+            "project_path": self.app.project_path,
             "theme": self.app.theme_name,
-            "overlays": [],
-            "text_layers": self.app.text_layers
+            "overlays": [self.entry(ov, self.overlay_entry) for ov in self.app.overlays],
+            "text_layers": [self.entry(tx, lambda tx: tx.to_dict()) for tx in self.app.text_layers]
         }
-        for ov in self.app.overlays:
-            entry = {
-                "path": ov.get("path"),
-                "x": ov.get("x", 0),
-                "y": ov.get("y", 0),
-                "scale": ov.get("scale", 1.0),
-                "angle": ov.get("angle", 0),
-                "visible": ov.get("visible", True)
-            }
-            data["overlays"].append(entry)
-        with open(self.autosave_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        live = {id(layer) for layer in self.app.overlays + self.app.text_layers}
+        self._entries = {k: v for k, v in self._entries.items() if k in live}
+        return data
+
+    def entry(self, layer, build):
+        # Saved form of a layer, rebuilt only when its revision moved.
+        cached = self._entries.get(id(layer))
+        if cached is None or cached[0] != layer.rev:
+            cached = self._entries[id(layer)] = (layer.rev, build(layer))
+        return cached[1]
+
+    def overlay_entry(self, ov):
+        entry = {
+            "path": ov.get("path"),
+            "x": ov.get("x", 0),
+            "y": ov.get("y", 0),
+            "scale": ov.get("scale", 1.0),
+            "angle": ov.get("angle", 0),
+            "visible": ov.get("visible", True),
+            "locked": ov.get("locked", False),
+            "name": ov.get("name"),
+            "opacity": ov.get("opacity", 1.0),
+            "blend": ov.get("blend", "normal")
+        }
+        if isinstance(ov["image"], LazyImage) and ov["image"].key:
+            # Layers opened from a project may have no file on disk; the asset store has them.
+            entry["asset"] = ov["image"].key
+        return entry
+
+    def save_state(self, force=False):
+        version = self.version()
+        if version == self._saved_version and version[0] is not None and not force:
+            return None
+        data = self.snapshot()
+        self._saved_version = version
+        self._sequence += 1
+        return self._writer.submit(self._write, self._sequence, data)
+
+    def _write(self, revision, data):
+        if self._base is not None and self._journal_lines < self.max_journal:
+            delta = diff_state(self._last, data)
+            if not delta:
+                return
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"revision": revision, "delta": delta}, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_lines += 1
+        else:
+            # Revisions restart every session, so the old journal goes first: a crash in
+            # between leaves the previous base without its deltas, never deltas replayed
+            # onto a base they were not taken against.
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            write_atomic(self.autosave_path, json.dumps(dict(data, revision=revision), indent=2))
+            self._base = data
+            self._journal_lines = 0
+        self._last = data
+
+    def read_state(self):
+        with open(self.autosave_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        base_revision = data.pop("revision", 0)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append.
+                        break
+                    if entry["revision"] > base_revision:
+                        apply_delta(data, entry["delta"])
+        return data
 
     def load_state(self):
         if not os.path.exists(self.autosave_path):
             return False
         try:
-            with open(self.autosave_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = self.read_state()
             if data.get("background_path") and os.path.exists(data["background_path"]):
-                from PIL import Image
-                self.app.background = Image.open(data["background_path"]).convert("RGB")
-                self.app.project_path = data["background_path"]
+                self.app.background = decode_full(data["background_path"], "RGB")
+                self.app.background_path = data["background_path"]
+                self.app.project_path = data.get("project_path") or os.path.dirname(data["background_path"])
+            elif data.get("background_asset") and AssetStore().has(data["background_asset"]):
+                self.app.background = Image.open(AssetStore().path(data["background_asset"])).convert("RGB")
+                self.app.background_path = data.get("background_path")
+                self.app.project_path = data.get("project_path")
+            self.app.background_asset = data.get("background_asset")
             self.app.overlays.clear()
+            store = AssetStore()
             for e in data.get("overlays", []):
+                # Overlays decode lazily, on the render worker, the first time they are drawn.
                 if e["path"] and os.path.exists(e["path"]):
-                    img = Image.open(e["path"]).convert("RGBA")
-                    self.app.overlays.append({
-                        "image": img,
-                        "path": e["path"],
-                        "x": e.get("x", 0),
-                        "y": e.get("y", 0),
-                        "scale": e.get("scale", 1.0),
-                        "angle": e.get("angle", 0),
-                        "visible": e.get("visible", True)
-                    })
-            self.app.text_layers = data.get("text_layers", [])
+                    img = lazy_file(e["path"])
+                elif e.get("asset") and store.has(e["asset"]):
+                    img = store.lazy(e["asset"])
+                else:
+                    continue
+                self.app.image_store.track(img)
+                self.app.overlays.append(OverlayLayer(
+                    image=img,
+                    path=e["path"],
+                    x=e.get("x", 0),
+                    y=e.get("y", 0),
+                    scale=e.get("scale", 1.0),
+                    angle=e.get("angle", 0),
+                    visible=e.get("visible", True),
+                    locked=e.get("locked", False),
+                    name=e.get("name") or os.path.basename(e["path"] or "Overlay"),
+                    opacity=e.get("opacity", 1.0),
+                    blend=e.get("blend", "normal")
+                ))
+            self.app.text_layers = [TextLayer(tx) for tx in data.get("text_layers", [])]
             theme = data.get("theme")
             if theme:
                 self.app.change_theme(theme)
             self.app.layer_manager.refresh_layers()
             self.app.text_panel.refresh_layer_list()
             self.app.update_canvas()
+            self._saved_version = self.version()
             return True
         except Exception as e:
             print("Autosave load failed:", e)
@@ -80,3 +219,15 @@ class AutoSaver:
 
     def stop(self):
         self.running = False
+        if self._job is not None:
+            try:
+                self.app.after_cancel(self._job)
+            except Exception:
+                pass
+            self._job = None
+        # Flush pending edits before the app goes away.
+        try:
+            self.save_state()
+        except Exception as e:
+            print("Autosave error:", e)
+        self._writer.shutdown(wait=True)
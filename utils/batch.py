@@ -0,0 +1,123 @@
+import os, sys, json, time, argparse
+from concurrent.futures import ProcessPoolExecutor
+from utils.scene import Scene
+from utils.image_utils import ImageUtils
+from utils.engines import ENGINES
+from utils.streaming import stream_export
+
+# Headless batch renderer:
+#   python -m utils.batch manifest.json --workers 8
+# The manifest is a list of jobs (or {"jobs": [...]}) such as
+#   {"scene": "scenes/ep01.json", "output": "out/ep01.jpg", "size": [1280, 720]}
+# where "scene" is a file written by AutoSaver.save_state or an inline dict.
+# Jobs with "stream": true (PNG/JPEG only) are rendered in bands of "band_height" rows,
+# which keeps memory flat for print-size outputs.
+# Cores are split between worker processes and each process's tile threads, so large
+# outputs never run cpu_count tile threads in every one of cpu_count processes.
+
+_utils = None
+_tile_workers = None
+
+def _init_worker(tile_workers):
+    global _tile_workers
+    _tile_workers = tile_workers
+
+def _worker_utils(engine="pillow"):
+    # One ImageUtils per worker process so its caches survive across jobs.
+    global _utils
+    if _utils is None:
+        _utils = ImageUtils(engine=engine, workers=_tile_workers)
+    elif _utils.engine.name != engine:
+        _utils.set_engine(engine)
+    return _utils
+
+def render_job(job):
+    try:
+        scene = job["scene"]
+        if isinstance(scene, dict):
+            scene = Scene.from_state(scene, base_dir=job.get("base_dir"))
+        else:
+            scene = Scene.from_file(scene)
+        if not scene.background:
+            return job["output"], "scene has no background"
+        out_dir = os.path.dirname(job["output"])
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        utils = _worker_utils(job.get("engine", "pillow"))
+        size = tuple(job["size"]) if job.get("size") else None
+        scale = job.get("scale") or (2 if job.get("upscale") else None)
+        if job.get("stream"):
+            stream_export(utils, scene, job["output"], size=size, scale=scale,
+                          band_height=job.get("band_height"), **job.get("save_options", {}))
+        else:
+            utils.compose_scene(scene, scale=scale, size=size).save(job["output"], **job.get("save_options", {}))
+        return job["output"], None
+    except Exception as e:
+        return job.get("output"), f"{type(e).__name__}: {e}"
+
+def load_manifest(path, out_dir=None, engine=None):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    jobs = data.get("jobs", []) if isinstance(data, dict) else data
+    base = os.path.dirname(os.path.abspath(path))
+    resolved = []
+    for job in jobs:
+        job = dict(job)
+        if isinstance(job["scene"], str) and not os.path.isabs(job["scene"]):
+            job["scene"] = os.path.join(base, job["scene"])
+        elif isinstance(job["scene"], dict):
+            job.setdefault("base_dir", base)
+        if not job.get("output"):
+            name = os.path.splitext(os.path.basename(job["scene"]))[0] if isinstance(job["scene"], str) \
+                else f"scene_{len(resolved) + 1}"
+            job["output"] = os.path.join(out_dir or base, name + ".jpg")
+        elif not os.path.isabs(job["output"]):
+            job["output"] = os.path.join(out_dir or base, job["output"])
+        if engine:
+            job.setdefault("engine", engine)
+        resolved.append(job)
+    return resolved
+
+def run_batch(jobs, workers=None, progress=None):
+    cores = os.cpu_count() or 1
+    workers = min(workers or cores, max(1, len(jobs)))
+    failed = []
+    if workers == 1:
+        results = map(render_job, jobs)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(max(1, cores // workers),))
+        # Coarse chunks keep IPC overhead low for large manifests.
+        results = pool.map(render_job, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+    try:
+        for done, (output, error) in enumerate(results, 1):
+            if error:
+                failed.append((output, error))
+            if progress:
+                progress(done, len(jobs), output, error)
+    finally:
+        if workers != 1:
+            pool.shutdown()
+    return len(jobs) - len(failed), failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render thumbnail scenes without the GUI.")
+    parser.add_argument("manifest", help="JSON manifest of render jobs")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("-o", "--out-dir", default=None, help="directory for relative/missing outputs")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=None, help="compositing engine")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest, args.out_dir, args.engine)
+
+    def report(done, total, output, error):
+        status = f"FAILED ({error})" if error else "ok"
+        print(f"[{done}/{total}] {output} {status}")
+
+    start = time.time()
+    ok, failed = run_batch(jobs, args.workers, report)
+    print(f"Rendered {ok}/{len(jobs)} scenes in {time.time() - start:.1f}s")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
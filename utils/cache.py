@@ -0,0 +1,74 @@
+import threading, hashlib
+from collections import OrderedDict
+
+def image_nbytes(img):
+    return img.width * img.height * len(img.getbands())
+
+def content_key(img):
+    # Identity of an image's pixels, stable across processes and sessions.
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{img.mode}{img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+class LRUCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, sizeof=image_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, owner=None):
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return value
+            # The owner reference keeps id()-based keys from being reused while cached.
+            self.entries[key] = (value, size, owner)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, old_size, _) = self.entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+        return value
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def invalidate(self, predicate):
+        with self.lock:
+            for key in [k for k in self.entries if predicate(k)]:
+                self.bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0
+            }
@@ -0,0 +1,121 @@
+from PIL import Image
+from utils.scene import scene_version
+
+# Incremental preview compositor: keeps the last frame and only recomposites the
+# union of the rectangles covered by layers that changed since the previous render.
+# A scene whose version (see utils/layers.py) and scale are unchanged is not even
+# walked: the last frame is returned as is.
+
+def union_box(a, b):
+    if a is None:
+        return b
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def sprite_box(sprite, pos):
+    return (pos[0], pos[1], pos[0] + sprite.width, pos[1] + sprite.height)
+
+class Compositor:
+    def __init__(self, image_utils, full_redraw_ratio=0.6):
+        self.utils = image_utils
+        self.full_redraw_ratio = full_redraw_ratio
+        self.frame = None
+        self.base = None
+        self.base_key = None
+        self.layers = []
+        self.version = None
+        self.full_renders = 0
+        self.partial_renders = 0
+
+    def reset(self):
+        self.frame = None
+        self.base_key = None
+        self.layers = []
+        self.version = None
+
+    # Returns (frame, dirty_box). dirty_box is None when the whole frame was redrawn
+    # and an empty box when nothing changed.
+    def render(self, scene, scale):
+        if not scene.background:
+            self.reset()
+            return None, None
+        # Images still showing their proxy change on screen once decoded, with no edit.
+        images = [scene.background] + [ov["image"] for ov in scene.overlays]
+        pending = sum(1 for img in images if not getattr(img, "loaded", True))
+        version = scene_version(scene)
+        version = (version, scale, pending) if version is not None else None
+        if self.frame is not None and version is not None and version == self.version:
+            return self.frame, (0, 0, 0, 0)
+        self.version = version
+        base = self.utils.background_at(scene.background, scale)
+        base_key = (id(scene.background), id(base), base.size)
+        layers = self.utils.layer_sprites(scene, scale)
+
+        dirty = None
+        if self.frame is not None and base_key == self.base_key and len(layers) == len(self.layers):
+            for old, new in zip(self.layers, layers):
+                if old[0] != new[0]:
+                    dirty = union_box(dirty, sprite_box(old[1], old[2]))
+                    dirty = union_box(dirty, sprite_box(new[1], new[2]))
+            self.base, self.layers = base, layers
+            if dirty is None:
+                return self.frame, (0, 0, 0, 0)
+            w, h = self.frame.size
+            dirty = (max(0, dirty[0]), max(0, dirty[1]), min(w, dirty[2]), min(h, dirty[3]))
+            if dirty[2] <= dirty[0] or dirty[3] <= dirty[1]:
+                return self.frame, (0, 0, 0, 0)
+            area = (dirty[2] - dirty[0]) * (dirty[3] - dirty[1])
+            if area < self.full_redraw_ratio * w * h:
+                self.frame.paste(self.utils.compose_region(base, layers, dirty), dirty[:2])
+                self.partial_renders += 1
+                return self.frame, dirty
+
+        self.base, self.base_key, self.layers = base, base_key, layers
+        self.frame = self.utils.compose_region(base, layers, (0, 0) + base.size)
+        self.full_renders += 1
+        return self.frame, None
+
+# Interactive drag: everything under the dragged layer is flattened into `below`
+# (RGB) and everything over it into `above` (RGBA), so each motion event only
+# re-blits the dragged sprite between two cached planes.
+class DragPlanes:
+    def __init__(self, image_utils, scene, layer_id, scale):
+        layers = image_utils.layer_sprites(scene, scale)
+        index = next((i for i, l in enumerate(layers) if l[0][0] == layer_id), None)
+        if index is None:
+            raise ValueError("layer is not visible")
+        base = image_utils.background_at(scene.background, scale)
+        self.utils = image_utils
+        self.size = base.size
+        self.below = image_utils.compose_region(base, layers[:index], (0, 0) + base.size)
+        self.above = None
+        self.above_layers = layers[index + 1:]
+        # Only "normal" layers can be pre-flattened; other blend modes are re-applied per move.
+        if self.above_layers and all(l[4] == "normal" for l in self.above_layers):
+            self.above = Image.new("RGBA", base.size, (0, 0, 0, 0))
+            for _, sprite, (x, y), opacity, _ in self.above_layers:
+                l, t = max(0, -x), max(0, -y)
+                if l >= sprite.width or t >= sprite.height:
+                    continue
+                if opacity < 1.0:
+                    sprite = sprite.copy()
+                    sprite.putalpha(sprite.getchannel("A").point(lambda a: int(a * opacity + 0.5)))
+                self.above.alpha_composite(sprite, (max(0, x), max(0, y)), (l, t))
+            self.above_layers = []
+        _, self.sprite, self.pos, self.opacity, self.mode = layers[index]
+
+    # Moves the sprite to `pos` and returns (patch, box) covering its old and new area.
+    def move(self, pos):
+        w, h = self.size
+        old = sprite_box(self.sprite, self.pos)
+        new = sprite_box(self.sprite, pos)
+        self.pos = pos
+        x0, y0, x1, y1 = union_box(old, new)
+        box = (max(0, x0), max(0, y0), min(w, x1), min(h, y1))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return None, box
+        layers = [(None, self.sprite, pos, self.opacity, self.mode)] + self.above_layers
+        patch = self.utils.compose_region(self.below, layers, box)
+        if self.above is not None:
+            top = self.above.crop(box)
+            patch.paste(top, (0, 0), top)
+        return patch, box
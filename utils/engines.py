@@ -0,0 +1,125 @@
+from PIL import Image, ImageChops
+import numpy as np
+from utils.cache import LRUCache
+
+# Compositing engines. Both take a region of the opaque RGB background and blend
+# pre-transformed RGBA sprites into it:
+#   begin(base, box, cache) -> canvas, blend(canvas, sprite, pos, opacity, mode), finish(canvas) -> Image
+# `pos` is relative to the region's top-left corner.
+
+BLEND_MODES = ("normal", "multiply", "screen", "add")
+
+def clip_box(canvas_size, sprite_size, pos):
+    # Overlap of a sprite placed at `pos` with the canvas: (canvas box, sprite box) or None.
+    x0, y0 = max(0, pos[0]), max(0, pos[1])
+    x1, y1 = min(canvas_size[0], pos[0] + sprite_size[0]), min(canvas_size[1], pos[1] + sprite_size[1])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1, y1), (x0 - pos[0], y0 - pos[1], x1 - pos[0], y1 - pos[1])
+
+class PillowEngine:
+    name = "pillow"
+
+    def begin(self, base, box, cache=True):
+        return base.crop(box)
+
+    def blend(self, canvas, sprite, pos, opacity=1.0, mode="normal"):
+        if mode == "normal" and opacity >= 1.0:
+            canvas.paste(sprite, pos, sprite)
+            return
+        clip = clip_box(canvas.size, sprite.size, pos)
+        if clip is None:
+            return
+        dst_box, src_box = clip
+        src = sprite.crop(src_box)
+        mask = src.getchannel("A")
+        if opacity < 1.0:
+            mask = mask.point(lambda a: int(a * opacity + 0.5))
+        rgb = src.convert("RGB")
+        if mode != "normal":
+            dst = canvas.crop(dst_box)
+            if mode == "multiply":
+                rgb = ImageChops.multiply(dst, rgb)
+            elif mode == "screen":
+                rgb = ImageChops.screen(dst, rgb)
+            elif mode == "add":
+                rgb = ImageChops.add(dst, rgb)
+        canvas.paste(rgb, dst_box[:2], mask)
+
+    def finish(self, canvas):
+        return canvas
+
+class NumpyEngine:
+    name = "numpy"
+
+    def __init__(self, cache_mb=128):
+        # Premultiplied uint16 copies of sprites, reused while the sprite is unchanged.
+        self.premultiplied = LRUCache(cache_mb * 1024 * 1024, sizeof=lambda v: v[0].nbytes + v[1].nbytes)
+        self.bases = LRUCache(cache_mb * 1024 * 1024, sizeof=lambda a: a.nbytes)
+
+    def premultiply(self, sprite, opacity):
+        # (color * alpha, alpha) as uint16 in 0..255*255 / 0..255, so "normal" blending
+        # stays in integer arithmetic.
+        key = (id(sprite), opacity)
+        cached = self.premultiplied.get(key)
+        if cached is None:
+            arr = np.asarray(sprite, dtype=np.uint16)
+            alpha = arr[..., 3:4]
+            if opacity < 1.0:
+                alpha = (alpha * opacity + 0.5).astype(np.uint16)
+            cached = self.premultiplied.put(key, (arr[..., :3] * alpha, alpha), owner=sprite)
+        return cached
+
+    def begin(self, base, box, cache=True):
+        if not cache:
+            return np.array(base.crop(box), dtype=np.uint8)
+        # Backgrounds are converted to arrays once; each render starts from a memcpy.
+        key = (id(base), base.size)
+        arr = self.bases.get(key)
+        if arr is None:
+            arr = self.bases.put(key, np.asarray(base.convert("RGB"), dtype=np.uint8), owner=base)
+        return arr[box[1]:box[3], box[0]:box[2]].copy()
+
+    def blend(self, canvas, sprite, pos, opacity=1.0, mode="normal"):
+        clip = clip_box((canvas.shape[1], canvas.shape[0]), sprite.size, pos)
+        if clip is None:
+            return
+        (x0, y0, x1, y1), (sx0, sy0, sx1, sy1) = clip
+        color, alpha = self.premultiply(sprite, opacity)
+        src = color[sy0:sy1, sx0:sx1]
+        a = alpha[sy0:sy1, sx0:sx1]
+        # The canvas is opaque, so its premultiplied and straight colors coincide.
+        if mode == "normal":
+            dst = canvas[y0:y1, x0:x1].astype(np.uint16)
+            dst *= 255 - a
+            dst += src
+            # Rounded division by 255 without leaving uint16.
+            dst += 128
+            dst += dst >> 8
+            dst >>= 8
+            canvas[y0:y1, x0:x1] = dst
+            return
+
+        src = src * np.float32(1 / 65025)
+        a = a * np.float32(1 / 255)
+        dst = canvas[y0:y1, x0:x1].astype(np.float32)
+        dst *= 1 / 255
+        if mode == "multiply":
+            dst *= (1 - a) + src
+        elif mode == "screen":
+            dst *= 1 - src
+            dst += src
+        elif mode == "add":
+            t = dst * a
+            t += src
+            np.minimum(t, a, out=t)
+            dst *= 1 - a
+            dst += t
+        dst *= 255
+        dst += 0.5
+        canvas[y0:y1, x0:x1] = dst
+
+    def finish(self, canvas):
+        return Image.fromarray(canvas, "RGB")
+
+ENGINES = {"pillow": PillowEngine, "numpy": NumpyEngine}
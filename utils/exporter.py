@@ -0,0 +1,128 @@
+import os, threading
+from PIL import ImageFile
+from utils.mipmap import MipPyramid
+from utils.streaming import stream_export, STREAM_OPTIONS
+
+# Export runs off the Tk thread: the scene is composed once at the largest target's
+# resolution and every other target is downsampled from that composite, then each is
+# encoded with its own settings. Targets larger than `stream_threshold` pixels are
+# instead rendered straight to disk in bands (see utils/streaming.py); the default
+# EXPORT_TARGETS all stay below it, so only custom target lists reach that path.
+# Progress and cancellation are plain attributes the UI polls.
+
+EXPORT_TARGETS = [
+    {"name": "YouTube", "suffix": "", "format": "JPEG", "size": (1280, 720),
+     "options": {"quality": 92, "optimize": True, "progressive": True, "subsampling": 0}},
+    {"name": "Master", "suffix": "_master", "format": "PNG", "size": (2560, 1440),
+     "options": {"compress_level": 6}},
+    {"name": "WebP", "suffix": "", "format": "WEBP", "size": (1280, 720),
+     "options": {"quality": 90, "method": 4}},
+    {"name": "Preview", "suffix": "_preview", "format": "JPEG", "size": (320, 180),
+     "options": {"quality": 80, "optimize": True}}
+]
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+def save_image(img, path, format, options):
+    if format == "JPEG" and (options.get("progressive") or options.get("optimize")):
+        # libjpeg must hold the whole progressive/optimized stream; Pillow sizes that
+        # buffer at one byte per pixel, which grainy 4:4:4 images can exceed.
+        ImageFile.MAXBLOCK = max(ImageFile.MAXBLOCK, 3 * img.width * img.height)
+    img.save(path, format=format, **options)
+
+class ExportCancelled(Exception):
+    pass
+
+def fit_size(size, box):
+    # Largest size with the scene's aspect ratio that fits in `box`.
+    r = min(box[0] / size[0], box[1] / size[1])
+    return max(1, round(size[0] * r)), max(1, round(size[1] * r))
+
+def target_path(base_path, target):
+    stem = os.path.splitext(base_path)[0]
+    return stem + target["suffix"] + EXTENSIONS[target["format"]]
+
+def targets_for(path, targets=None):
+    # The picked file's format becomes a primary (unsuffixed) target, so the file the
+    # user named is always among those written.
+    targets = list(targets or EXPORT_TARGETS)
+    ext = os.path.splitext(path)[1].lower().replace(".jpeg", ".jpg")
+    fmt = next((f for f, e in EXTENSIONS.items() if e == ext), None)
+    if fmt is None or any(t["format"] == fmt and not t["suffix"] for t in targets):
+        return targets
+    i = next((i for i, t in enumerate(targets) if t["format"] == fmt), None)
+    if i is None:
+        return [{"name": fmt, "suffix": "", "format": fmt, "size": targets[0]["size"], "options": {}}] + targets
+    targets[i] = dict(targets[i], suffix="")
+    return targets
+
+class ExportJob:
+    def __init__(self, image_utils, scene, base_path, targets=None, stream_threshold=16_000_000):
+        self.utils = image_utils
+        self.scene = scene
+        self.base_path = base_path
+        self.targets = targets or EXPORT_TARGETS
+        self.stream_threshold = stream_threshold
+        self.progress = 0.0
+        self.status = "Waiting"
+        self.outputs = []
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _step(self, status, progress):
+        if self._cancel.is_set():
+            raise ExportCancelled()
+        self.status = status
+        self.progress = progress
+
+    def streamed(self, target, size):
+        return target["format"] in STREAM_OPTIONS and size[0] * size[1] > self.stream_threshold
+
+    def compose(self, sizes):
+        # Layers are rendered from their sources directly at the largest target's size.
+        return self.utils.compose_scene(self.scene, size=max(sizes))
+
+    def run(self):
+        bg = self.scene.background
+        sizes = [fit_size(bg.size, t["size"]) for t in self.targets]
+        in_memory = [size for t, size in zip(self.targets, sizes) if not self.streamed(t, size)]
+        # Steps: one composite, then a resize and an encode per target.
+        steps = 1 + 2 * len(self.targets)
+        self._step("Composing", 0.0)
+        pyramid = MipPyramid(self.compose(in_memory)) if in_memory else None
+        done = 1
+        for target, size in zip(self.targets, sizes):
+            path = target_path(self.base_path, target)
+            if self.streamed(target, size):
+                start = done
+                stream_export(self.utils, self.scene, path, size=size, format=target["format"],
+                              progress=lambda f: self._step(f"Rendering {target['name']}", (start + 2 * f) / steps),
+                              **target.get("options", {}))
+                self.outputs.append(path)
+                done += 2
+                continue
+            self._step(f"Resizing {target['name']}", done / steps)
+            img = pyramid.resized(size)
+            if target["format"] == "JPEG" and img.mode != "RGB":
+                img = img.convert("RGB")
+            self._step(f"Encoding {target['name']}", (done + 1) / steps)
+            # Written under a temporary name so a cancelled or failed export never leaves
+            # a truncated file behind.
+            tmp = path + ".part"
+            try:
+                save_image(img, tmp, target["format"], target.get("options", {}))
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            self.outputs.append(path)
+            done += 2
+        self.status = "Done"
+        self.progress = 1.0
+        return self.outputs
@@ -0,0 +1,229 @@
+import time
+from PIL import Image
+from utils.cache import image_nbytes
+from utils.project import LazyImage
+from utils.scene import scene_version
+
+# Scene-wide undo/redo built from diff records.
+#
+# The history keeps a baseline: one shallow copy per live layer dict. Bitmaps are
+# shared by reference, never copied. commit() compares the live scene with the
+# baseline and records only what moved: changed keys per layer, layer list order and
+# membership, and the background (image, path and asset key). Only the changed layers' baseline copies are
+# refreshed. Consecutive commits that touch the same layer keys within `coalesce_s`
+# merge into one record, so a typed word or a slider drag undoes in one step.
+# Typed layers (utils/layers.py) carry revisions: a commit on an unchanged scene stops at
+# one version comparison, and only layers whose revision moved are diffed.
+
+MISSING = object()
+KINDS = ("overlays", "text_layers")
+# Attributes that change together when the background is replaced; the image comes first.
+BACKGROUND = ("background", "background_path", "background_asset")
+# Rough cost of one recorded non-image value.
+VALUE_BYTES = 64
+
+def _is_image(v):
+    return isinstance(v, (Image.Image, LazyImage))
+
+def _same(a, b):
+    if a is b:
+        return True
+    if _is_image(a) or _is_image(b):
+        return False
+    return a == b
+
+class Record:
+    def __init__(self, signature):
+        self.signature = signature
+        self.layers = {}
+        self.order = {}
+        self.background = None
+        self.time = time.monotonic()
+
+    def values(self):
+        for layer, before, after in self.layers.values():
+            yield from before.values()
+            yield from after.values()
+        # Layers dropped from the scene stay alive through the record that removed them.
+        for before, after in self.order.values():
+            for layer in before + after:
+                if layer.get("image") is not None:
+                    yield layer["image"]
+        if self.background:
+            yield from (state[0] for state in self.background)
+
+class History:
+    def __init__(self, app, budget_mb=256, coalesce_s=1.0):
+        self.app = app
+        self.budget = budget_mb * 1024 * 1024
+        self.coalesce_s = coalesce_s
+        self.undo_stack = []
+        self.redo_stack = []
+        self.restoring = False
+        self._held = {}
+        self._small = 0
+        self.reset()
+
+    def reset(self):
+        # Takes the current scene as the starting point and forgets all records.
+        for rec in self.undo_stack + self.redo_stack:
+            self._release(rec)
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._background = self._background_state()
+        self._order = {kind: list(getattr(self.app, kind)) for kind in KINDS}
+        self._copies = {id(layer): dict(layer) for kind in KINDS for layer in self._order[kind]}
+        self._revs = {id(layer): getattr(layer, "rev", None) for kind in KINDS for layer in self._order[kind]}
+        self._version = scene_version(self.app)
+
+    def _background_state(self):
+        return tuple(getattr(self.app, name, None) for name in BACKGROUND)
+
+    def commit(self):
+        if self.restoring:
+            return None
+        version = scene_version(self.app)
+        if version is not None and version == self._version:
+            return None
+        changes = {}
+        for kind in KINDS:
+            for layer in getattr(self.app, kind):
+                # New layers are covered by the order change below.
+                base = self._copies.get(id(layer))
+                if base is None:
+                    continue
+                rev = getattr(layer, "rev", None)
+                if rev is not None and rev == self._revs.get(id(layer)):
+                    continue
+                keys = set(layer) | set(base)
+                before = {k: base.get(k, MISSING) for k in keys if not _same(base.get(k, MISSING), layer.get(k, MISSING))}
+                if before:
+                    changes[id(layer)] = (layer, before, {k: layer.get(k, MISSING) for k in before})
+        order = {}
+        for kind in KINDS:
+            live = getattr(self.app, kind)
+            if [id(l) for l in live] != [id(l) for l in self._order[kind]]:
+                order[kind] = (self._order[kind], list(live))
+        background = None
+        if self.app.background is not self._background[0]:
+            background = (self._background, self._background_state())
+        if not changes and not order and not background:
+            return None
+
+        signature = None
+        if not order and not background:
+            signature = frozenset((lid, k) for lid, (_, before, _) in changes.items() for k in before)
+        last = self.undo_stack[-1] if self.undo_stack else None
+        now = time.monotonic()
+        if (signature and last and not self.redo_stack and last.signature == signature
+                and now - last.time < self.coalesce_s):
+            # Same keys of the same layers again: extend the last step instead of adding one.
+            self._release(last)
+            for lid, (layer, _, after) in changes.items():
+                last.layers[lid][2].update(after)
+            last.time = now
+            self._retain(last)
+        else:
+            rec = Record(signature)
+            rec.layers, rec.order, rec.background = changes, order, background
+            self._clear_redo()
+            self.undo_stack.append(rec)
+            self._retain(rec)
+
+        for lid, (layer, _, _) in changes.items():
+            self._copies[lid] = dict(layer)
+            self._revs[lid] = getattr(layer, "rev", None)
+        self._sync_baseline()
+        self.trim()
+        return self.undo_stack[-1]
+
+    def seal(self):
+        # The next commit starts a new step even if it touches the same keys.
+        if self.undo_stack:
+            self.undo_stack[-1].signature = None
+
+    def undo(self):
+        return self._step(self.undo_stack, self.redo_stack, 1)
+
+    def redo(self):
+        return self._step(self.redo_stack, self.undo_stack, 2)
+
+    def _step(self, source, target, side):
+        # side 1 restores each change's "before" values, side 2 its "after" values.
+        self.commit()
+        if not source:
+            return False
+        rec = source.pop()
+        self.restoring = True
+        try:
+            for kind, lists in rec.order.items():
+                getattr(self.app, kind)[:] = lists[side - 1]
+            for layer, *values in rec.layers.values():
+                for k, v in values[side - 1].items():
+                    if v is MISSING:
+                        layer.pop(k, None)
+                    else:
+                        layer[k] = v
+                self._copies[id(layer)] = dict(layer)
+                self._revs[id(layer)] = getattr(layer, "rev", None)
+            if rec.background:
+                for name, value in zip(BACKGROUND, rec.background[side - 1]):
+                    setattr(self.app, name, value)
+            self._sync_baseline()
+        finally:
+            self.restoring = False
+        rec.signature = None
+        target.append(rec)
+        return True
+
+    def _sync_baseline(self):
+        self._background = self._background_state()
+        self._order = {kind: list(getattr(self.app, kind)) for kind in KINDS}
+        live = {id(layer): layer for kind in KINDS for layer in self._order[kind]}
+        for lid in list(self._copies):
+            if lid not in live:
+                del self._copies[lid]
+                self._revs.pop(lid, None)
+        for lid, layer in live.items():
+            if lid not in self._copies:
+                self._copies[lid] = dict(layer)
+                self._revs[lid] = getattr(layer, "rev", None)
+        self._version = scene_version(self.app)
+
+    def _retain(self, rec):
+        for v in rec.values():
+            if _is_image(v):
+                entry = self._held.setdefault(id(v), [v, 0])
+                entry[1] += 1
+            else:
+                self._small += VALUE_BYTES
+
+    def _release(self, rec):
+        for v in rec.values():
+            if _is_image(v):
+                entry = self._held[id(v)]
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._held[id(v)]
+            else:
+                self._small -= VALUE_BYTES
+
+    def _clear_redo(self):
+        for rec in self.redo_stack:
+            self._release(rec)
+        self.redo_stack.clear()
+
+    def usage(self):
+        # Bytes kept alive only by the history: bitmaps the live scene no longer uses.
+        live = {id(self.app.background)}
+        live.update(id(layer.get("image")) for layer in self.app.overlays)
+        images = sum(image_nbytes(img) for key, (img, _) in self._held.items() if key not in live)
+        return images + self._small
+
+    def trim(self):
+        while len(self.undo_stack) > 1 and self.usage() > self.budget:
+            self._release(self.undo_stack.pop(0))
+
+    def stats(self):
+        return {"undo": len(self.undo_stack), "redo": len(self.redo_stack), "bytes": self.usage(),
+                "budget": self.budget}
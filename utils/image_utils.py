@@ -1,78 +1,264 @@
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageFilter
-import numpy as np, cv2, math
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
+import numpy as np, cv2, math, threading, os
+from concurrent.futures import ThreadPoolExecutor
+from utils.cache import LRUCache, image_nbytes
+from utils.mipmap import MipPyramid
+from utils.scene import layer_uid
+from utils.engines import ENGINES
+from utils.project import LazyImage, realize
 
 class ImageUtils:
-    def __init__(self):
+    def __init__(self, overlay_cache_mb=256, text_cache_mb=64, mip_cache_mb=128, engine="pillow",
+                 workers=None, tile_size=512, tile_threshold=4_000_000):
         self.snap_distance = 20
         self.snap_lines = []
+        self.workers = workers or os.cpu_count() or 1
+        self.tile_size = tile_size
+        self.tile_threshold = tile_threshold
+        self._pool = None
+        self.overlay_cache = LRUCache(overlay_cache_mb * 1024 * 1024)
+        self.text_cache = LRUCache(text_cache_mb * 1024 * 1024, sizeof=lambda v: image_nbytes(v[0]))
+        self.mip_cache = LRUCache(mip_cache_mb * 1024 * 1024, sizeof=lambda p: p.nbytes)
+        # (layer, scale) slot -> cache key it last drew with, and how many slots use each key.
+        self._overlay_keys = {}
+        self._overlay_refs = {}
+        self._keys_lock = threading.Lock()
+        self._fonts = {}
+        self.set_engine(engine)
+        # FreeType faces are shared between the preview worker and export.
+        self._font_lock = threading.Lock()
 
-    def compose_scene(self, app, upscale=False):
-        if not app.background:
-            return None
-        bg = app.background.copy()
-        if upscale:
-            bg = bg.resize((bg.width * 2, bg.height * 2), Image.LANCZOS)
-        draw = ImageDraw.Draw(bg)
+    def set_engine(self, name):
+        self.engine = ENGINES[name]()
 
-        for ov in app.overlays:
-            if not ov.get("visible", True):
-                continue
-            overlay = ov["image"].copy()
-            s = ov.get("scale", 1.0)
-            if upscale: s *= 2
-            new_size = (max(1, int(overlay.width * s)), max(1, int(overlay.height * s)))
-            overlay = overlay.resize(new_size, Image.LANCZOS)
-            if ov.get("angle", 0) != 0:
-                overlay = overlay.rotate(ov["angle"], expand=True)
-            pos = (int(ov["x"] * (2 if upscale else 1)), int(ov["y"] * (2 if upscale else 1)))
-            if overlay.mode != "RGBA":
-                overlay = overlay.convert("RGBA")
-            bg.paste(overlay, pos, overlay)
-
-        for tx in app.text_layers:
-            if not tx.get("visible", True) or not tx.get("text"):
-                continue
+    def pyramid(self, img):
+        key = (id(img), img.size)
+        pyr = self.mip_cache.get(key)
+        if pyr is None:
+            pyr = self.mip_cache.put(key, MipPyramid(img), owner=img)
+        return pyr
+
+    def background_at(self, bg, scale):
+        # Cached preview-scale background; callers must not draw on it.
+        size = (max(1, round(bg.width * scale)), max(1, round(bg.height * scale)))
+        if isinstance(bg, LazyImage):
+            # The draft-decoded proxy stands in until the full decode is done.
+            bg, scale = bg.source_for(scale)
+        if size == bg.size:
+            return bg
+        if scale > 1:
+            return bg.resize(size, Image.LANCZOS)
+        key = ("bg", id(bg), size)
+        scaled = self.overlay_cache.get(key)
+        if scaled is None:
+            scaled = self.overlay_cache.put(key, self.pyramid(bg).resized(size), owner=bg)
+        return scaled
+
+    def get_font(self, family, size):
+        key = (family, size)
+        font = self._fonts.get(key)
+        if font is None:
             try:
-                f = ImageFont.truetype("arial.ttf", tx["font_size"] * (2 if upscale else 1))
+                font = ImageFont.truetype(family, size)
             except Exception:
-                f = ImageFont.load_default()
-            x, y = tx["x"] * (2 if upscale else 1), tx["y"] * (2 if upscale else 1)
-            bold = max(1, tx["bold"] * (2 if upscale else 1))
+                # Resolve the fallback once instead of raising on every redraw.
+                try:
+                    font = ImageFont.load_default(size)
+                except TypeError:
+                    font = ImageFont.load_default()
+            self._fonts[key] = font
+        return font
+
+    def text_sprite(self, tx, scale=1):
+        size = int(tx["font_size"] * scale)
+        bold = max(1, int(tx["bold"] * scale))
+        family = tx.get("font", "arial.ttf")
+        style = tx.get("outline", "stroke")
+        key = (tx["text"], family, size, bold, tx["color"], style)
+        cached = self.text_cache.get(key)
+        if cached is not None:
+            return cached
+
+        with self._font_lock:
+            sprite, offset = self._rasterize_text(tx, family, size, bold, style)
+        return self.text_cache.put(key, (sprite, offset))
+
+    def _rasterize_text(self, tx, family, size, bold, style):
+        font = self.get_font(family, size)
+        if style == "offset":
+            # Legacy look: stamp the glyphs at 8 offsets of `bold` pixels.
+            left, top, right, bottom = font.getbbox(tx["text"])
+            left, top, right, bottom = left - bold, top - bold, right + bold, bottom + bold
+            outline = Image.new("L", (right - left, bottom - top), 0)
+            draw = ImageDraw.Draw(outline)
             for dx in range(-bold, bold + 1, bold):
                 for dy in range(-bold, bold + 1, bold):
                     if dx == 0 and dy == 0: continue
-                    draw.text((x + dx, y + dy), tx["text"], font=f, fill="black")
-            draw.text((x, y), tx["text"], font=f, fill=tx["color"])
+                    draw.text((dx - left, dy - top), tx["text"], font=font, fill=255)
+        else:
+            # Single-pass stroke from FreeType; no gaps at large widths.
+            left, top, right, bottom = font.getbbox(tx["text"], stroke_width=bold)
+            outline = Image.new("L", (right - left, bottom - top), 0)
+            ImageDraw.Draw(outline).text((-left, -top), tx["text"], font=font, fill=255, stroke_width=bold)
+        box = outline.size
+        fill = Image.new("L", box, 0)
+        ImageDraw.Draw(fill).text((-left, -top), tx["text"], font=font, fill=255)
+
+        sprite = Image.new("RGBA", box, (0, 0, 0, 0))
+        sprite.paste((0, 0, 0, 255), mask=outline)
+        sprite.paste(tx["color"], mask=fill)
+        # Offset of the sprite's top-left corner relative to the layer's (x, y).
+        return sprite, (left, top)
+
+    def transformed_overlay(self, ov, scale=1.0):
+        src = ov["image"]
+        s = ov.get("scale", 1.0) * scale
+        if isinstance(src, LazyImage):
+            # Until a lazily opened layer is decoded its proxy stands in where it is sharp enough.
+            src, s = src.source_for(s)
+        angle = ov.get("angle", 0)
+        key = (id(src), src.size, round(s, 6), angle)
+        # A layer whose transform changed will not reuse its previous bitmap, unless another
+        # layer still draws with it.
+        slot = (layer_uid(ov), scale)
+        with self._keys_lock:
+            old = self._overlay_keys.get(slot)
+            if old != key:
+                self._overlay_keys[slot] = key
+                self._overlay_refs[key] = self._overlay_refs.get(key, 0) + 1
+                if old is not None and self._release_key(old):
+                    self.overlay_cache.pop(old)
+
+        cached = self.overlay_cache.get(key)
+        if cached is not None:
+            return cached
+        new_size = (max(1, int(src.width * s)), max(1, int(src.height * s)))
+        # Downscales start from the nearest mip level instead of the full-res source.
+        overlay = self.pyramid(src).resized(new_size) if s < 1 else src.resize(new_size, Image.LANCZOS)
+        if angle != 0:
+            overlay = overlay.rotate(angle, expand=True)
+        if overlay.mode != "RGBA":
+            overlay = overlay.convert("RGBA")
+        return self.overlay_cache.put(key, overlay, owner=src)
+
+    def _release_key(self, key):
+        # True when no slot uses `key` any more.
+        n = self._overlay_refs.pop(key) - 1
+        if n:
+            self._overlay_refs[key] = n
+        return not n
 
-        if upscale:
-            bg = ImageEnhance.Sharpness(bg).enhance(1.5)
-        return bg
+    def prune_overlay_keys(self, scene):
+        # Forgets the slots of layers no longer in the scene; their bitmaps age out of the LRU.
+        live = {layer_uid(ov) for ov in scene.overlays}
+        with self._keys_lock:
+            for slot in [slot for slot in self._overlay_keys if slot[0] not in live]:
+                self._release_key(self._overlay_keys.pop(slot))
+
+    # (signature, sprite, position, opacity, blend mode) for every visible layer, bottom
+    # to top. The signature changes whenever the layer's pixels or placement change.
+    def layer_sprites(self, scene, scale=1):
+        self.prune_overlay_keys(scene)
+        layers = []
+        for ov in scene.overlays:
+            if not ov.get("visible", True):
+                continue
+            overlay = self.transformed_overlay(ov, scale)
+            pos = (int(ov["x"] * scale), int(ov["y"] * scale))
+            opacity, mode = ov.get("opacity", 1.0), ov.get("blend", "normal")
+            layers.append(((layer_uid(ov), id(overlay), pos, opacity, mode), overlay, pos, opacity, mode))
+
+        for tx in scene.text_layers:
+            if not tx.get("visible", True) or not tx.get("text"):
+                continue
+            sprite, (ox, oy) = self.text_sprite(tx, scale)
+            pos = (int(tx["x"] * scale + ox), int(tx["y"] * scale + oy))
+            opacity, mode = tx.get("opacity", 1.0), tx.get("blend", "normal")
+            layers.append(((layer_uid(tx), id(sprite), pos, opacity, mode), sprite, pos, opacity, mode))
+        return layers
+
+    def background_tile(self, bg, scale, box):
+        # Background pixels for one output tile; upscales resample only the tile's source area.
+        if scale <= 1:
+            return self.background_at(bg, scale), box
+        # Mapped through the rounded output size, as background_at stretches the whole
+        # background to it, so tiles and bands sample exactly where the untiled path does.
+        fx = bg.width / max(1, round(bg.width * scale))
+        fy = bg.height / max(1, round(bg.height * scale))
+        src = (box[0] * fx, box[1] * fy, box[2] * fx, box[3] * fy)
+        tile = realize(bg).resize((box[2] - box[0], box[3] - box[1]), Image.LANCZOS, box=src)
+        return tile, (0, 0) + tile.size
+
+    def compose_tiled(self, bg, scale, layers, size):
+        # OpenCV/NumPy/Pillow release the GIL, so tiles blend in parallel on threads.
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tile")
+        w, h = size
+        t = self.tile_size
+
+        def render(box):
+            base, base_box = self.background_tile(bg, scale, box)
+            canvas = self.engine.begin(base, base_box, cache=scale <= 1)
+            for _, sprite, (x, y), opacity, mode in layers:
+                if x < box[2] and y < box[3] and x + sprite.width > box[0] and y + sprite.height > box[1]:
+                    self.engine.blend(canvas, sprite, (x - box[0], y - box[1]), opacity, mode)
+            return self.engine.finish(canvas)
+
+        boxes = [(x, y, min(x + t, w), min(y + t, h)) for y in range(0, h, t) for x in range(0, w, t)]
+        out = Image.new("RGB", size)
+        for box, tile in zip(boxes, self._pool.map(render, boxes)):
+            out.paste(tile, box)
+        return out
+
+    def compose_region(self, base, layers, box):
+        canvas = self.engine.begin(base, box)
+        for _, sprite, (x, y), opacity, mode in layers:
+            if x < box[2] and y < box[3] and x + sprite.width > box[0] and y + sprite.height > box[1]:
+                self.engine.blend(canvas, sprite, (x - box[0], y - box[1]), opacity, mode)
+        return self.engine.finish(canvas)
+
+    # Works on any object exposing background / overlays / text_layers
+    # (the app window or a headless utils.scene.Scene).
+    # The output resolution is `size` (fitted to the scene's aspect ratio), or `scale`
+    # times the background; `upscale` is shorthand for scale=2. Text is rasterized and
+    # overlays resampled from their sources at that scale, so nothing is rendered at an
+    # intermediate resolution.
+    def compose_scene(self, scene, upscale=False, scale=None, size=None):
+        if not scene.background:
+            return None
+        bg = scene.background
+        if size is not None:
+            scale = min(size[0] / bg.width, size[1] / bg.height)
+        elif scale is None:
+            scale = 2 if upscale else 1
+        size = (max(1, round(bg.width * scale)), max(1, round(bg.height * scale)))
+        layers = self.layer_sprites(scene, scale)
+        if self.workers > 1 and size[0] * size[1] >= self.tile_threshold:
+            return self.compose_tiled(bg, scale, layers, size)
+        base = self.background_at(bg, scale)
+        return self.compose_region(base, layers, (0, 0) + base.size)
 
     def gpu_blur(self, pil_img, radius=3):
         arr = np.array(pil_img)
         blurred = cv2.GaussianBlur(arr, (0, 0), radius)
         return Image.fromarray(blurred)
 
-    def snap_position(self, app, x, y, w, h):
-        snap_x, snap_y = x, y
-        self.snap_lines.clear()
-        canvas_w = app.canvas.winfo_width()
-        canvas_h = app.canvas.winfo_height()
-        center_x = canvas_w / 2
-        center_y = canvas_h / 2
-        ox = x + w / 2
-        oy = y + h / 2
-        if abs(ox - center_x) < self.snap_distance:
-            snap_x = center_x - w / 2
-            self.snap_lines.append(("v", center_x))
-        if abs(oy - center_y) < self.snap_distance:
-            snap_y = center_y - h / 2
-            self.snap_lines.append(("h", center_y))
-        return snap_x, snap_y
-
-    def draw_snap_guides(self, app):
-        for line in self.snap_lines:
-            if line[0] == "v":
-                app.canvas.create_line(line[1], 0, line[1], app.canvas.winfo_height(), fill="cyan", dash=(4, 4))
-            elif line[0] == "h":
-                app.canvas.create_line(0, line[1], app.canvas.winfo_width(), line[1], fill="cyan", dash=(4, 4))
+    def snap_position(self, index, layer, x, y, distance=None):
+        # Scene-space (x, y) for `layer`, pulled onto the nearest edge or centre of the
+        # canvas or another layer (see utils/spatial.py) within `distance` scene pixels.
+        box = layer.bbox(self, 1.0)
+        dx, dy = x - layer["x"], y - layer["y"]
+        box = (box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy)
+        sx, sy, self.snap_lines = index.snap(id(layer), box, distance or self.snap_distance)
+        return int(round(x + sx)), int(round(y + sy))
+
+    def draw_snap_guides(self, canvas, ratio, origin):
+        # snap_lines are in scene coordinates; the preview shows them at `ratio` from `origin`.
+        canvas.delete("snap")
+        for kind, v in self.snap_lines:
+            if kind == "v":
+                x = origin[0] + v * ratio
+                canvas.create_line(x, 0, x, canvas.winfo_height(), fill="cyan", dash=(4, 4), tags="snap")
+            else:
+                y = origin[1] + v * ratio
+                canvas.create_line(0, y, canvas.winfo_width(), y, fill="cyan", dash=(4, 4), tags="snap")
@@ -0,0 +1,166 @@
+import os, sys, math, ctypes, shutil, tempfile, threading, itertools, weakref
+import numpy as np
+from PIL import Image
+from utils.cache import image_nbytes
+from utils.project import LazyImage, realize
+from utils.exporter import EXPORT_TARGETS, fit_size
+
+# Owner of overlay bitmaps under a RAM budget.
+#   - adopt() caps an imported image at the resolution the largest export target can
+#     draw it with over the current background. The full resolution stays reachable
+#     through the layer's loader (asset data, or a spill file written here).
+#   - enforce() brings the heap-resident pixels back under budget, coldest first: a
+#     decoded image that can be reloaded is dropped, anything else is written to a raw
+#     file in spill_dir and replaced by a read-only memory-mapped view that the OS pages
+#     in when the layer is drawn. Loaders that read the user's own files are volatile
+#     (see utils/loader.py) and count as not reloadable.
+# Mapped views and files only count as "mapped", never as resident.
+
+MAPPABLE = ("RGBA", "L")
+
+def heap_nbytes(img):
+    # Memory-mapped views (readonly) live in the page cache, not on the heap.
+    if img is None or getattr(img, "readonly", 0):
+        return 0
+    return image_nbytes(img)
+
+def map_file(path, mode, size):
+    w, h = size
+    buf = np.memmap(path, dtype=np.uint8, mode="r", shape=(h, w, len(mode)))
+    return Image.frombuffer(mode, size, buf, "raw", mode, 0, 1)
+
+try:
+    _libc = ctypes.CDLL("libc.so.6") if sys.platform.startswith("linux") else None
+except OSError:
+    _libc = None
+
+def release_freed():
+    # glibc keeps freed image blocks in its heap; hand them back to the OS.
+    if _libc is not None:
+        _libc.malloc_trim(0)
+
+def reloadable(img):
+    return img.loader is not None and not getattr(img.loader, "volatile", False)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class ImageStore:
+    def __init__(self, budget_mb=512, spill_dir=None, targets=None):
+        self.budget = budget_mb * 1024 * 1024
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix="ytthumb-spill-")
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self.targets = targets or EXPORT_TARGETS
+        self.max_scale = 1.0
+        self.images = weakref.WeakValueDictionary()
+        self.spills = 0
+        self.drops = 0
+        self._names = itertools.count()
+        self._lock = threading.RLock()
+
+    def set_background(self, size):
+        # Largest scale any export target draws this background at.
+        self.max_scale = max(fit_size(size, t["size"])[0] / size[0] for t in self.targets) if size else 1.0
+
+    def adopt(self, img, loader=None):
+        # Returns the LazyImage a layer should hold; call off the Tk thread for large images.
+        if not isinstance(img, LazyImage):
+            img = LazyImage(loader, img.size, mode=img.mode, image=img)
+        elif loader and img.loader is None:
+            img.loader = loader
+        w, h = img.size
+        if self.max_scale < 1 and img.mode in MAPPABLE:
+            size = (max(1, math.ceil(w * self.max_scale)), max(1, math.ceil(h * self.max_scale)))
+            if img.proxy is None or img.proxy.width > size[0]:
+                full = realize(img)
+                if not reloadable(img):
+                    self.spill_full(img, full)
+                img.proxy = full.resize(size, Image.LANCZOS, reducing_gap=3.0)
+                img._image = None
+        return self.track(img)
+
+    def track(self, img):
+        # Puts an image under the budget without capping it.
+        if isinstance(img, LazyImage):
+            with self._lock:
+                self.images[id(img)] = img
+        return img
+
+    def pending(self, img):
+        # True when exports will need pixels that are not decoded yet.
+        return isinstance(img, LazyImage) and not img.loaded and (
+            img.proxy is None or img.proxy.width < img.width * self.max_scale)
+
+    def _spill(self, lazy, image):
+        path = os.path.join(self.spill_dir, f"{next(self._names)}.raw")
+        with open(path, "wb") as f:
+            # In bands, so spilling never needs a second full-size copy.
+            for y in range(0, image.height, 256):
+                f.write(image.crop((0, y, image.width, min(image.height, y + 256))).tobytes())
+        weakref.finalize(lazy, _remove, path)
+        self.spills += 1
+        return path
+
+    def spill_full(self, lazy, image):
+        path = self._spill(lazy, image)
+        mode, size = image.mode, image.size
+        lazy.loader = lambda: map_file(path, mode, size)
+
+    def resident(self, img):
+        if not isinstance(img, LazyImage):
+            return heap_nbytes(img)
+        return heap_nbytes(img._image) + heap_nbytes(img.proxy)
+
+    def mapped(self, img):
+        if not isinstance(img, LazyImage):
+            return image_nbytes(img) - heap_nbytes(img)
+        return sum(image_nbytes(i) - heap_nbytes(i) for i in (img._image, img.proxy) if i is not None)
+
+    def usage(self):
+        with self._lock:
+            return sum(self.resident(img) for img in list(self.images.values()))
+
+    def enforce(self):
+        # Safe from any thread: layers keep rendering from whatever they last read.
+        with self._lock:
+            live = sorted(self.images.values(), key=lambda img: img.used)
+            total = start = sum(self.resident(img) for img in live)
+            for img in live:
+                if total <= self.budget:
+                    break
+                before = self.resident(img)
+                full = img._image
+                if heap_nbytes(full):
+                    if not reloadable(img):
+                        if full.mode not in MAPPABLE:
+                            continue
+                        self.spill_full(img, full)
+                    img._image = None
+                    self.drops += 1
+                proxy = img.proxy
+                if total - before + self.resident(img) > self.budget and heap_nbytes(proxy) and proxy.mode in MAPPABLE:
+                    img.proxy = map_file(self._spill(img, proxy), proxy.mode, proxy.size)
+                total -= before - self.resident(img)
+            if total < start:
+                release_freed()
+            return total
+
+    def report(self, scene):
+        # Bytes per layer and in total: resident on the heap, mapped from disk, and at full resolution.
+        layers = []
+        for i, ov in enumerate(scene.overlays):
+            img = ov["image"]
+            layers.append({"name": ov.get("name") or f"Overlay {i+1}", "resident": self.resident(img),
+                           "mapped": self.mapped(img), "full": image_nbytes(img)})
+        bg = scene.background
+        if bg is not None:
+            layers.insert(0, {"name": "Background", "resident": self.resident(bg), "mapped": self.mapped(bg),
+                              "full": image_nbytes(bg)})
+        return {"layers": layers, "resident": sum(l["resident"] for l in layers),
+                "mapped": sum(l["mapped"] for l in layers), "budget": self.budget}
+
+    def close(self):
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
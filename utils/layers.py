@@ -0,0 +1,163 @@
+import itertools, math
+
+# Typed scene layers. They keep the dict interface the rest of the code was written
+# against (layer["x"], layer.get("name"), dict(layer), "visible" in layer), but store
+# their fields in __slots__ and carry a revision: every assignment that changes a value
+# takes a fresh number from one process-wide counter, so "did this layer change?" is an
+# integer comparison. Keys outside a class's FIELDS (such as a snapshot's _uid) live in
+# a small overflow dict.
+
+_revisions = itertools.count(1)
+
+def next_revision():
+    return next(_revisions)
+
+# Values compared by equality when assigned; anything else (images) by identity.
+_PLAIN = (int, float, str, bool, type(None), tuple)
+
+def rotated_size(w, h, angle):
+    # Size of Image.rotate(angle, expand=True) for a w x h image, computed the way Pillow does.
+    angle = angle % 360.0
+    if angle == 0 or angle == 180:
+        return w, h
+    if angle in (90, 270):
+        return h, w
+    a = -math.radians(angle)
+    cos, sin = round(math.cos(a), 15), round(math.sin(a), 15)
+    cx, cy = w / 2.0, h / 2.0
+    tx = cos * -cx + sin * -cy + cx
+    ty = -sin * -cx + cos * -cy + cy
+    xs = [cos * x + sin * y + tx for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    ys = [-sin * x + cos * y + ty for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    return math.ceil(max(xs)) - math.floor(min(xs)), math.ceil(max(ys)) - math.floor(min(ys))
+
+class Layer:
+    __slots__ = ("rev", "_extra", "_bbox")
+    FIELDS = {}
+
+    def __init__(self, values=(), **kwargs):
+        for name, default in self.FIELDS.items():
+            setattr(self, name, default)
+        self._extra = None
+        self._bbox = None
+        self.update(values, **kwargs)
+        self.rev = next_revision()
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            old = getattr(self, key)
+            if old is value or (isinstance(value, _PLAIN) and isinstance(old, _PLAIN) and old == value):
+                return
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+        self.rev = next_revision()
+
+    def __contains__(self, key):
+        return key in self.FIELDS or bool(self._extra and key in self._extra)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.FIELDS) + len(self._extra or ())
+
+    def __repr__(self):
+        return f"{type(self).__name__}(rev={self.rev}, {self.to_dict()!r})"
+
+    def keys(self):
+        return list(self.FIELDS) + list(self._extra or ())
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        return default
+
+    def pop(self, key, *default):
+        # Declared fields cannot disappear; popping one resets it to its default.
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            self[key] = self.FIELDS[key]
+            return value
+        if self._extra and key in self._extra:
+            self.rev = next_revision()
+            return self._extra.pop(key)
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, values=(), **kwargs):
+        for k, v in dict(values, **kwargs).items():
+            self[k] = v
+
+    def to_dict(self):
+        return {k: v for k, v in self.items() if not k.startswith("_")}
+
+    def copy(self):
+        # Same class, fields and revision; a copy of an unchanged layer is "unchanged".
+        new = object.__new__(type(self))
+        for name in self.FIELDS:
+            setattr(new, name, getattr(self, name))
+        new._extra = dict(self._extra) if self._extra else None
+        new._bbox = self._bbox
+        new.rev = self.rev
+        return new
+
+    def snapshot(self, uid):
+        new = self.copy()
+        new._extra = dict(new._extra or (), _uid=uid)
+        return new
+
+    def bbox(self, image_utils, scale=1.0):
+        # (x0, y0, x1, y1) of the layer's pixels at `scale`, cached until the layer changes.
+        key = (self.rev, scale)
+        if self._bbox is None or self._bbox[0] != key:
+            self._bbox = (key, self.measure(image_utils, scale))
+        return self._bbox[1]
+
+class OverlayLayer(Layer):
+    FIELDS = {"image": None, "path": None, "name": "Overlay", "x": 0, "y": 0, "scale": 1.0, "angle": 0,
+              "visible": True, "locked": False, "opacity": 1.0, "blend": "normal"}
+    __slots__ = tuple(FIELDS)
+
+    def measure(self, image_utils, scale):
+        # Same sizes transformed_overlay produces, without rendering anything.
+        s = self.scale * scale
+        w, h = self.image.size
+        w, h = rotated_size(max(1, int(w * s)), max(1, int(h * s)), self.angle) if self.angle else \
+            (max(1, int(w * s)), max(1, int(h * s)))
+        x, y = int(self.x * scale), int(self.y * scale)
+        return x, y, x + w, y + h
+
+class TextLayer(Layer):
+    FIELDS = {"text": "", "font": "arial.ttf", "font_size": 80, "bold": 2, "color": "white", "outline": "stroke",
+              "name": None, "x": 0, "y": 0, "visible": True, "locked": False, "opacity": 1.0, "blend": "normal"}
+    __slots__ = tuple(FIELDS)
+
+    def measure(self, image_utils, scale):
+        if not self.text:
+            x, y = int(self.x * scale), int(self.y * scale)
+            return x, y, x, y
+        sprite, (ox, oy) = image_utils.text_sprite(self, scale)
+        x, y = int(self.x * scale + ox), int(self.y * scale + oy)
+        return x, y, x + sprite.width, y + sprite.height
+
+def as_layer(cls, layer):
+    return layer if isinstance(layer, cls) else cls(layer)
@@ -0,0 +1,63 @@
+from PIL import Image
+from utils.project import LazyImage
+
+# Image loading for the editor. EXIF orientation is applied once, here, so every later
+# stage sees upright pixels. JPEGs get a preview immediately from a draft (DCT-scaled)
+# decode, which reads 1/2 to 1/8 of the resolution for a fraction of the cost, while the
+# full-resolution decode is left to a worker thread (see prefetch in utils/project.py).
+
+PREVIEW_SIDE = 1280
+ORIENTATION = 0x0112
+TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90
+}
+# Orientations that swap width and height.
+SWAPPED = (5, 6, 7, 8)
+
+def _upright(im, orientation, mode):
+    if im.mode != mode:
+        im = im.convert(mode)
+    method = TRANSPOSE.get(orientation)
+    return im.transpose(method) if method else im
+
+def decode_full(path, mode):
+    im = Image.open(path)
+    orientation = im.getexif().get(ORIENTATION, 1)
+    im.load()
+    return _upright(im, orientation, mode)
+
+def file_loader(path, mode):
+    # Reloads from the user's file, which may be moved or edited meanwhile; marked so an
+    # ImageStore spills these pixels to its own file instead of trusting the reload.
+    def load():
+        return decode_full(path, mode)
+    load.volatile = True
+    return load
+
+def open_image(path, mode, preview_side=PREVIEW_SIDE):
+    # A LazyImage with a draft-decoded proxy for JPEGs, otherwise the decoded image.
+    im = Image.open(path)
+    orientation = im.getexif().get(ORIENTATION, 1)
+    w, h = im.size
+    if im.format != "JPEG" or max(w, h) <= preview_side:
+        im.load()
+        return _upright(im, orientation, mode)
+    r = preview_side / max(w, h)
+    im.draft("RGB", (max(1, int(w * r)), max(1, int(h * r))))
+    proxy = _upright(im, orientation, mode)
+    size = (h, w) if orientation in SWAPPED else (w, h)
+    return LazyImage(file_loader(path, mode), size, proxy, mode=mode)
+
+def lazy_file(path, mode="RGBA"):
+    # Only the header is read now; pixels are decoded on first use.
+    with Image.open(path) as im:
+        orientation = im.getexif().get(ORIENTATION, 1)
+        w, h = im.size
+    size = (h, w) if orientation in SWAPPED else (w, h)
+    return LazyImage(file_loader(path, mode), size, mode=mode)
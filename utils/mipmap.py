@@ -0,0 +1,27 @@
+from PIL import Image
+
+class MipPyramid:
+    def __init__(self, image, min_side=32):
+        self.levels = [image]
+        img = image
+        while min(img.size) // 2 >= min_side:
+            img = img.reduce(2)
+            self.levels.append(img)
+
+    @property
+    def nbytes(self):
+        # Level 0 is the caller's image; only the downsampled copies are owned here.
+        return sum(im.width * im.height * len(im.getbands()) for im in self.levels[1:])
+
+    def level_for(self, scale):
+        # Smallest level that still has at least `scale` of the source resolution.
+        index = 0
+        while index + 1 < len(self.levels) and scale <= 1 / (2 ** (index + 1)):
+            index += 1
+        return self.levels[index]
+
+    def resized(self, size, resample=Image.LANCZOS):
+        level = self.level_for(size[0] / self.levels[0].width)
+        if level.size == size:
+            return level.copy()
+        return level.resize(size, resample)
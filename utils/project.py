@@ -0,0 +1,242 @@
+import os, io, json, time, zipfile, threading
+from PIL import Image
+from utils.cache import content_key
+from utils.scene import Scene
+from utils.layers import OverlayLayer, TextLayer
+
+# Single-file projects (.ytproj): a zip holding
+#   scene.json            layer state; images are referenced by content hash
+#   assets/<hash>.png     full-resolution pixels, stored once however many layers use them
+#   proxies/<hash>.png    small previews decoded at open time
+# Every asset also lands in a machine-wide content-addressed store, so re-saving or
+# opening projects that share images never re-encodes them, and thin projects
+# (embed=False) can reference the store instead of carrying their own copies.
+
+PROJECT_EXT = ".ytproj"
+PROJECT_VERSION = 1
+PROXY_SIDE = 256
+# The background fills the canvas, so its preview needs more pixels than a layer's.
+BACKGROUND_PROXY_SIDE = 1280
+
+class LazyImage:
+    # Stands in for an overlay's PIL image until its full pixels are first needed.
+    def __init__(self, loader, size, proxy=None, key=None, read_bytes=None, mode="RGBA", image=None):
+        self.loader = loader
+        self.size = tuple(size)
+        self.mode = mode
+        self.proxy = proxy
+        self.key = key
+        self.read_bytes = read_bytes
+        self.used = time.monotonic()
+        self._image = image
+        self._lock = threading.Lock()
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def getbands(self):
+        return tuple(self.mode)
+
+    @property
+    def loaded(self):
+        return self._image is not None
+
+    def image(self):
+        self.used = time.monotonic()
+        # Read once: an ImageStore may drop the decoded pixels from another thread.
+        img = self._image
+        if img is None:
+            with self._lock:
+                if self._image is None:
+                    self._image = self.loader()
+                img = self._image
+        return img
+
+    def source_for(self, scale):
+        # (image, scale) for rendering at `scale` of the full size: the proxy while the
+        # full image is not decoded and the proxy is still sharp enough.
+        self.used = time.monotonic()
+        proxy = self.proxy
+        if self._image is None and proxy is not None and scale * self.width <= proxy.width:
+            return proxy, scale * self.width / proxy.width
+        return self.image(), scale
+
+def realize(img):
+    return img.image() if isinstance(img, LazyImage) else img
+
+class AssetStore:
+    def __init__(self, root=None):
+        self.root = root or os.path.join(os.path.expanduser("~"), ".ytthumb", "assets")
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + ".png")
+
+    def has(self, key):
+        return os.path.isfile(self.path(key))
+
+    def read(self, key):
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def write(self, key, data):
+        path = self.path(key)
+        if os.path.isfile(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def lazy(self, key):
+        data = self.read(key)
+        with Image.open(io.BytesIO(data)) as im:
+            size = im.size
+        return LazyImage(lambda: decode(data, "RGBA"), size, key=key, read_bytes=lambda: data)
+
+def encode_png(img):
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+def decode(data, mode):
+    return Image.open(io.BytesIO(data)).convert(mode)
+
+def make_proxy(img, side=PROXY_SIDE):
+    r = min(1.0, side / max(img.size))
+    return img.resize((max(1, int(img.width * r)), max(1, int(img.height * r))), Image.LANCZOS, reducing_gap=2.0)
+
+def asset_bytes(img, store):
+    # (hash, PNG bytes); known assets are copied rather than decoded and re-encoded.
+    if isinstance(img, LazyImage) and img.key:
+        if store.has(img.key):
+            return img.key, store.read(img.key)
+        if img.read_bytes:
+            return img.key, img.read_bytes()
+    img = realize(img)
+    key = content_key(img)
+    if store.has(key):
+        return key, store.read(key)
+    return key, encode_png(img)
+
+def overlay_state(ov, key):
+    return {
+        "asset": key,
+        "size": list(ov["image"].size),
+        "path": ov.get("path"),
+        "x": ov.get("x", 0),
+        "y": ov.get("y", 0),
+        "scale": ov.get("scale", 1.0),
+        "angle": ov.get("angle", 0),
+        "visible": ov.get("visible", True),
+        "locked": ov.get("locked", False),
+        "name": ov.get("name"),
+        "opacity": ov.get("opacity", 1.0),
+        "blend": ov.get("blend", "normal")
+    }
+
+def save_project(path, scene, theme=None, store=None, embed=True):
+    store = store or AssetStore()
+    files = {}
+
+    def add(img, proxy_side=PROXY_SIDE):
+        key, data = asset_bytes(img, store)
+        store.write(key, data)
+        if embed:
+            files[f"assets/{key}.png"] = data
+        if f"proxies/{key}.png" not in files:
+            small = make_proxy(img.proxy if isinstance(img, LazyImage) and img.proxy else realize(img), proxy_side)
+            files[f"proxies/{key}.png"] = encode_png(small)
+        return key
+
+    state = {"version": PROJECT_VERSION, "theme": theme, "background": None, "overlays": [],
+             "text_layers": [{k: v for k, v in tx.items() if not k.startswith("_")} for tx in scene.text_layers]}
+    if scene.background:
+        state["background"] = {"asset": add(scene.background, BACKGROUND_PROXY_SIDE),
+                               "size": list(scene.background.size),
+                               "path": getattr(scene, "background_path", None)}
+    for ov in scene.overlays:
+        state["overlays"].append(overlay_state(ov, add(ov["image"])))
+
+    tmp = path + ".tmp"
+    with zipfile.ZipFile(tmp, "w") as zf:
+        zf.writestr("scene.json", json.dumps(state, separators=(",", ":")), compress_type=zipfile.ZIP_DEFLATED)
+        # PNG data is already compressed.
+        for name, data in files.items():
+            zf.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+    os.replace(tmp, path)
+
+class ProjectReader:
+    # The zip is reopened for every read rather than held open: saving over the project
+    # replaces the file, which Windows refuses while a handle is open.
+    def __init__(self, path, store):
+        self.path = path
+        self.store = store
+        self.lock = threading.Lock()
+
+    def read_entry(self, name):
+        with self.lock:
+            try:
+                with zipfile.ZipFile(self.path) as zf:
+                    return zf.read(name)
+            except (OSError, KeyError, zipfile.BadZipFile):
+                return None
+
+    def read(self, key, folder="assets"):
+        data = self.read_entry(f"{folder}/{key}.png")
+        if data is None and folder == "assets":
+            # Thin projects, or a project re-saved without this asset: the store has every
+            # asset that was ever saved or loaded.
+            return self.store.read(key)
+        return data
+
+    def lazy(self, key, size=None, mode="RGBA"):
+        def load():
+            data = self.read(key)
+            self.store.write(key, data)
+            return decode(data, mode)
+        if size is None:
+            # Projects saved before backgrounds recorded their size: read the PNG header.
+            with Image.open(io.BytesIO(self.read(key))) as im:
+                size = im.size
+        proxy = self.read(key, "proxies")
+        if proxy is not None:
+            proxy = decode(proxy, mode)
+        return LazyImage(load, size, proxy, key, read_bytes=lambda: self.read(key), mode=mode)
+
+def load_project(path, store=None):
+    # Metadata and proxies only; full pixels decode on first use (see prefetch).
+    reader = ProjectReader(path, store or AssetStore())
+    with zipfile.ZipFile(path) as zf:
+        state = json.loads(zf.read("scene.json"))
+    scene = Scene()
+    bg = state.get("background")
+    if bg:
+        scene.background = reader.lazy(bg["asset"], bg.get("size"), mode="RGB")
+        scene.background_path = bg.get("path")
+    for e in state.get("overlays", []):
+        scene.overlays.append(OverlayLayer(
+            image=reader.lazy(e["asset"], e["size"]),
+            path=e.get("path"),
+            x=e.get("x", 0),
+            y=e.get("y", 0),
+            scale=e.get("scale", 1.0),
+            angle=e.get("angle", 0),
+            visible=e.get("visible", True),
+            locked=e.get("locked", False),
+            name=e.get("name") or "Overlay",
+            opacity=e.get("opacity", 1.0),
+            blend=e.get("blend", "normal")
+        ))
+    scene.text_layers = [TextLayer(tx) for tx in state.get("text_layers", [])]
+    return scene, state
+
+def prefetch(scene, pool):
+    # Decode the full-resolution background and overlays in the background; returns their futures.
+    images = [scene.background] + [ov["image"] for ov in scene.overlays]
+    return [pool.submit(img.image) for img in images if isinstance(img, LazyImage) and not img.loaded]
@@ -0,0 +1,85 @@
+import importlib.util, threading
+import multiprocessing as mp
+from PIL import Image
+from utils.cache import LRUCache, content_key
+
+# Background removal in a long-lived worker process. The process imports rembg and
+# creates its ONNX session once, then serves masks for raw RGB buffers sent over a pipe.
+# Masks are cached by image content, so repeated removals of the same photo skip the model.
+
+AVAILABLE = importlib.util.find_spec("rembg") is not None
+
+def _serve(conn, model):
+    from rembg import new_session, remove
+    session = new_session(model)
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        size, data = job
+        try:
+            img = Image.frombuffer("RGB", size, data, "raw", "RGB", 0, 1)
+            mask = remove(img, session=session, only_mask=True).convert("L")
+            conn.send((True, mask.tobytes()))
+        except Exception as e:
+            conn.send((False, str(e)))
+
+class BackgroundRemover:
+    def __init__(self, model="u2net", cache_mb=64):
+        self.model = model
+        self.masks = LRUCache(cache_mb * 1024 * 1024)
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.process is not None and self.process.is_alive():
+            return
+        # spawn, not fork: the parent is a Tk process with live threads.
+        ctx = mp.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_serve, args=(child, self.model), name="rembg", daemon=True)
+        self.process.start()
+        child.close()
+
+    def mask(self, img):
+        rgb = img.convert("RGB")
+        key = content_key(rgb)
+        mask = self.masks.get(key)
+        if mask is None:
+            with self.lock:
+                self.start()
+                try:
+                    self.conn.send((rgb.size, rgb.tobytes()))
+                    ok, data = self.conn.recv()
+                except (EOFError, OSError):
+                    # The worker died (e.g. out of memory); the next call starts a new one.
+                    self.process.terminate()
+                    self.process = None
+                    ok, data = False, "Background removal worker stopped unexpectedly."
+            if not ok:
+                raise RuntimeError(data)
+            mask = self.masks.put(key, Image.frombytes("L", rgb.size, data))
+        return mask
+
+    def remove(self, img):
+        # Same output as rembg's default cutout: transparent (black) outside the mask.
+        rgba = img.convert("RGBA")
+        return Image.composite(rgba, Image.new("RGBA", rgba.size, (0, 0, 0, 0)), self.mask(img))
+
+    def remove_many(self, images):
+        return [self.remove(img) for img in images]
+
+    def stop(self):
+        with self.lock:
+            if self.process is None:
+                return
+            try:
+                self.conn.send(None)
+            except Exception:
+                pass
+            self.process.join(timeout=2)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.conn.close()
+            self.process = self.conn = None
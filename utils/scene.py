@@ -0,0 +1,84 @@
+import os, json
+from PIL import Image
+from utils.layers import OverlayLayer, TextLayer
+
+def layer_uid(layer):
+    # Snapshot copies carry the identity of the live layer they were taken from.
+    return layer.get("_uid") or id(layer)
+
+def scene_version(source):
+    # Aggregate of the background and every layer's revision, in order. Two equal
+    # versions mean nothing visible changed; None when layers carry no revisions.
+    bg = source.background
+    parts = [(id(bg), bg.size) if bg else None]
+    for layers in (source.overlays, source.text_layers):
+        for layer in layers:
+            rev = getattr(layer, "rev", None)
+            if rev is None:
+                return None
+            parts.append((layer_uid(layer), rev))
+        parts.append(None)
+    return tuple(parts)
+
+class Scene:
+    def __init__(self, background=None, overlays=None, text_layers=None, background_path=None):
+        self.background = background
+        self.background_path = background_path
+        self.overlays = overlays if overlays is not None else []
+        self.text_layers = text_layers if text_layers is not None else []
+
+    @classmethod
+    def snapshot(cls, source):
+        # Shallow per-layer copies so a worker thread can render while the UI keeps editing.
+        def copy(layer):
+            if hasattr(layer, "snapshot"):
+                return layer.snapshot(layer_uid(layer))
+            return dict(layer, _uid=layer_uid(layer))
+        return cls(
+            source.background,
+            [copy(ov) for ov in source.overlays],
+            [copy(tx) for tx in source.text_layers],
+            getattr(source, "background_path", None)
+        )
+
+    @property
+    def version(self):
+        return scene_version(self)
+
+    @classmethod
+    def from_state(cls, data, base_dir=None):
+        def resolve(p):
+            if p and base_dir and not os.path.isabs(p):
+                return os.path.join(base_dir, p)
+            return p
+
+        scene = cls()
+        bg_path = resolve(data.get("background_path"))
+        if bg_path and os.path.isfile(bg_path):
+            scene.background = Image.open(bg_path).convert("RGB")
+            scene.background_path = bg_path
+        for e in data.get("overlays", []):
+            path = resolve(e.get("path"))
+            if not path or not os.path.isfile(path):
+                continue
+            scene.overlays.append(OverlayLayer(
+                image=Image.open(path).convert("RGBA"),
+                path=path,
+                x=e.get("x", 0),
+                y=e.get("y", 0),
+                scale=e.get("scale", 1.0),
+                angle=e.get("angle", 0),
+                visible=e.get("visible", True),
+                locked=e.get("locked", False),
+                name=e.get("name", os.path.basename(path)),
+                opacity=e.get("opacity", 1.0),
+                blend=e.get("blend", "normal")
+            ))
+        scene.text_layers = [TextLayer(tx) for tx in data.get("text_layers", [])]
+        return scene
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls.from_state(data, base_dir=os.path.dirname(os.path.abspath(path)))
@@ -0,0 +1,93 @@
+import threading, time
+from collections import deque
+
+# Runs an expensive render callable on a worker thread. Only the newest request is
+# rendered (older queued ones are dropped) and finished frames are handed back to
+# the Tk thread through widget.after().
+
+class RenderScheduler:
+    def __init__(self, widget, render, present, poll_ms=8, name="render"):
+        self.widget = widget
+        self.render = render
+        self.present = present
+        self.poll_ms = poll_ms
+        self._cond = threading.Condition()
+        self._pending = None
+        self._results = deque()
+        self._busy = False
+        self._polling = False
+        self.running = True
+        self.frames = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_latency = 0.0
+        self.avg_latency = 0.0
+        self.thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, *args):
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (time.perf_counter(), args)
+            self._cond.notify()
+        self._schedule_poll()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self.running and self._pending is None:
+                    self._cond.wait()
+                if not self.running:
+                    return
+                requested, args = self._pending
+                self._pending = None
+                self._busy = True
+            try:
+                result = self.render(*args)
+            except Exception as e:
+                self.errors += 1
+                print("Render error:", e)
+                result = None
+            with self._cond:
+                self._busy = False
+                self._results.append((requested, result))
+
+    def _schedule_poll(self):
+        if self._polling or not self.running:
+            return
+        try:
+            self.widget.after(self.poll_ms, self._poll)
+            self._polling = True
+        except Exception:
+            pass
+
+    def _poll(self):
+        self._polling = False
+        with self._cond:
+            results = list(self._results)
+            self._results.clear()
+            idle = not self._busy and self._pending is None
+        # Results are presented in order: partial (dirty-rect) frames depend on their predecessors.
+        for requested, result in results:
+            if result is None:
+                continue
+            self.last_latency = (time.perf_counter() - requested) * 1000
+            self.avg_latency = self.last_latency if not self.frames else 0.9 * self.avg_latency + 0.1 * self.last_latency
+            self.frames += 1
+            try:
+                self.present(result)
+            except Exception as e:
+                self.errors += 1
+                print("Present error:", e)
+        if not idle:
+            self._schedule_poll()
+
+    def stats(self):
+        return {"frames": self.frames, "dropped": self.dropped, "errors": self.errors,
+                "last_latency_ms": self.last_latency, "avg_latency_ms": self.avg_latency}
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify()
@@ -0,0 +1,174 @@
+import math
+from bisect import bisect_left
+from collections import defaultdict
+from utils.project import LazyImage
+from utils.scene import scene_version
+
+# Spatial index over the layers' scene-space boxes (Layer.bbox at scale 1), for snapping
+# and picking while dragging.
+#   Snapping: the left/centre/right x and top/middle/bottom y of every layer and of the
+#             canvas live in two sorted arrays, so the nearest edge is a bisect away.
+#   Picking:  a uniform grid maps cells to the layers overlapping them; candidates under
+#             the pointer are tested top-down against their actual alpha.
+# update() moves one layer in O(log n) searches plus list shifts; sync() reconciles with a
+# scene by revision, touching only layers that changed.
+
+CANVAS = "canvas"
+
+def _edges(box):
+    return ((box[0], (box[0] + box[2]) / 2, box[2]), (box[1], (box[1] + box[3]) / 2, box[3]))
+
+def _insert(vals, ids, v, uid):
+    i = bisect_left(vals, v)
+    vals.insert(i, v)
+    ids.insert(i, uid)
+
+def _delete(vals, ids, v, uid):
+    i = bisect_left(vals, v)
+    while ids[i] != uid:
+        i += 1
+    del vals[i]
+    del ids[i]
+
+class SpatialIndex:
+    def __init__(self, image_utils, cell=256):
+        self.utils = image_utils
+        self.cell = cell
+        self.xs, self.x_ids = [], []
+        self.ys, self.y_ids = [], []
+        self.boxes = {}
+        self.layers = {}
+        self.order = {}
+        self.grid = defaultdict(set)
+        self.size = None
+        self.version = None
+
+    def sync(self, scene):
+        version = scene_version(scene)
+        if version is not None and version == self.version:
+            return
+        self.version = version
+        bg = scene.background
+        size = bg.size if bg else None
+        if size != self.size:
+            # Grid cells are clipped to the canvas, so a new canvas re-files every layer.
+            for uid in list(self.boxes):
+                self.remove(uid)
+            self.size = size
+            if size:
+                self._add(CANVAS, None, (0, 0) + size)
+        live = set()
+        for z, layer in enumerate(scene.overlays + scene.text_layers):
+            live.add(id(layer))
+            self.order[id(layer)] = z
+            entry = self.boxes.get(id(layer))
+            if entry is None or entry[0] != layer.rev:
+                self.update(layer)
+        for uid in [uid for uid in self.boxes if uid != CANVAS and uid not in live]:
+            self.remove(uid)
+            self.order.pop(uid, None)
+
+    def update(self, layer):
+        uid = id(layer)
+        if uid in self.boxes:
+            self.remove(uid)
+        if self.size is None or not layer.get("visible", True) or ("text" in layer and not layer["text"]):
+            return
+        self._add(uid, layer, layer.bbox(self.utils, 1.0))
+
+    def _add(self, uid, layer, box):
+        self.boxes[uid] = (layer.rev if layer is not None else None, box)
+        self.layers[uid] = layer
+        xe, ye = _edges(box)
+        for v in xe:
+            _insert(self.xs, self.x_ids, v, uid)
+        for v in ye:
+            _insert(self.ys, self.y_ids, v, uid)
+        if layer is not None:
+            for key in self._cells(box):
+                self.grid[key].add(uid)
+
+    def remove(self, uid):
+        _, box = self.boxes.pop(uid)
+        layer = self.layers.pop(uid)
+        xe, ye = _edges(box)
+        for v in xe:
+            _delete(self.xs, self.x_ids, v, uid)
+        for v in ye:
+            _delete(self.ys, self.y_ids, v, uid)
+        if layer is not None:
+            for key in self._cells(box):
+                cell = self.grid[key]
+                cell.discard(uid)
+                if not cell:
+                    del self.grid[key]
+
+    def _cells(self, box):
+        w, h = self.size
+        c = self.cell
+        x0, y0 = max(0, box[0]) // c, max(0, box[1]) // c
+        x1, y1 = (min(w, box[2]) - 1) // c, (min(h, box[3]) - 1) // c
+        return [(cx, cy) for cx in range(int(x0), int(x1) + 1) for cy in range(int(y0), int(y1) + 1)]
+
+    @staticmethod
+    def _nearest(vals, ids, v, exclude):
+        # Closest value to v in a sorted array, skipping entries owned by `exclude`.
+        i = bisect_left(vals, v)
+        best = None
+        j = i - 1
+        while j >= 0 and ids[j] == exclude:
+            j -= 1
+        if j >= 0:
+            best = vals[j]
+        j = i
+        while j < len(vals) and ids[j] == exclude:
+            j += 1
+        if j < len(vals) and (best is None or vals[j] - v < v - best):
+            best = vals[j]
+        return best
+
+    def snap(self, uid, box, distance):
+        # (dx, dy, guides) moving `box` onto the nearest edge or centre within `distance`.
+        shifts = []
+        for vals, ids, edges in ((self.xs, self.x_ids, _edges(box)[0]), (self.ys, self.y_ids, _edges(box)[1])):
+            best = None
+            for v in edges:
+                t = self._nearest(vals, ids, v, uid)
+                if t is not None and abs(t - v) <= distance and (best is None or abs(t - v) < abs(best[0] - best[1])):
+                    best = (t, v)
+            shifts.append(best)
+        guides = [(kind, s[0]) for kind, s in zip(("v", "h"), shifts) if s]
+        dx = shifts[0][0] - shifts[0][1] if shifts[0] else 0
+        dy = shifts[1][0] - shifts[1][1] if shifts[1] else 0
+        return dx, dy, guides
+
+    def hit(self, x, y, threshold=16):
+        # Topmost layer whose pixel at scene point (x, y) is at least `threshold` opaque.
+        if self.size is None or not (0 <= x < self.size[0] and 0 <= y < self.size[1]):
+            return None
+        candidates = self.grid.get((int(x) // self.cell, int(y) // self.cell), ())
+        for uid in sorted(candidates, key=lambda u: self.order.get(u, -1), reverse=True):
+            box = self.boxes[uid][1]
+            if box[0] <= x < box[2] and box[1] <= y < box[3] and self.alpha(self.layers[uid], box, x, y) >= threshold:
+                return self.layers[uid]
+        return None
+
+    def alpha(self, layer, box, x, y):
+        if layer.get("image") is None:
+            sprite, _ = self.utils.text_sprite(layer, 1.0)
+            return sprite.getpixel((int(x - box[0]), int(y - box[1])))[3]
+        src, s = layer["image"], layer.get("scale", 1.0)
+        if isinstance(src, LazyImage):
+            # Picking only needs a rough pixel; a proxy is good enough.
+            src, s = src.source_for(s)
+        # Undo the rotation about the box centre, then map into source pixels.
+        u, v = x - (box[0] + box[2]) / 2, y - (box[1] + box[3]) / 2
+        angle = layer.get("angle", 0)
+        if angle:
+            a = math.radians(angle)
+            u, v = u * math.cos(a) - v * math.sin(a), u * math.sin(a) + v * math.cos(a)
+        sx, sy = int(u / s + src.width / 2), int(v / s + src.height / 2)
+        if not (0 <= sx < src.width and 0 <= sy < src.height):
+            return 0
+        px = src.getpixel((sx, sy))
+        return px[3] if src.mode == "RGBA" else 255
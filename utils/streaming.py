@@ -0,0 +1,176 @@
+import os, mmap, struct, tempfile, zlib
+import numpy as np
+from PIL import Image
+from utils.project import realize
+
+# Bounded-memory export for very large outputs (print sizes, 8K banners). The scene is
+# rendered in horizontal bands and each band is encoded before the next one is drawn, so
+# peak RAM follows the band size rather than the output size. Bands are `band_height`
+# rows, or as many rows as fit in `band_pixels` when no height is given.
+#   PNG:  rows are filtered and deflated incrementally into IDAT chunks.
+#   JPEG: bands go into a disk-backed RGBX buffer that Pillow maps without copying and
+#         encodes as baseline (progressive/optimize would buffer the whole image). The
+#         encoder reads every page back, so this bounds the heap, not the page cache.
+
+# Encoder settings each streaming writer understands; others (progressive, optimize)
+# would need the whole image in memory and are dropped.
+STREAM_OPTIONS = {"PNG": ("compress_level",), "JPEG": ("quality", "subsampling")}
+
+def output_geometry(bg, size=None, scale=None):
+    if size is not None:
+        scale = min(size[0] / bg.width, size[1] / bg.height)
+    scale = scale or 1.0
+    # Rounded like exporter.fit_size, so a fitted size comes back unchanged.
+    return scale, (max(1, round(bg.width * scale)), max(1, round(bg.height * scale)))
+
+def overlay_rows(utils, ov, scale, y0, y1):
+    # Rows [y0, y1) of an unrotated overlay at `scale`, resampled from its source:
+    # (sprite strip, position) or None. Matches transformed_overlay row for row.
+    src = realize(ov["image"])
+    s = ov.get("scale", 1.0) * scale
+    sw, sh = max(1, int(src.width * s)), max(1, int(src.height * s))
+    px, py = int(ov["x"] * scale), int(ov["y"] * scale)
+    r0, r1 = max(0, y0 - py), min(sh, y1 - py)
+    if r1 <= r0:
+        return None
+    level = utils.pyramid(src).level_for(s) if s < 1 else src
+    fy = level.height / sh
+    strip = level.resize((sw, r1 - r0), Image.LANCZOS, box=(0, r0 * fy, level.width, r1 * fy))
+    if strip.mode != "RGBA":
+        strip = strip.convert("RGBA")
+    return strip, (px, py + r0)
+
+def iter_bands(utils, scene, scale, size, band_height=256):
+    # Yields (y0, HxWx3 uint8 array) top to bottom.
+    bg = scene.background
+    w, h = size
+    # Rotated overlays and text are small enough to rasterize whole (and are cached).
+    whole = {}
+    for i, ov in enumerate(scene.overlays):
+        if ov.get("visible", True) and ov.get("angle", 0) != 0:
+            whole[i] = utils.transformed_overlay(ov, scale)
+    texts = []
+    for tx in scene.text_layers:
+        if tx.get("visible", True) and tx.get("text"):
+            sprite, (ox, oy) = utils.text_sprite(tx, scale)
+            texts.append((sprite, (int(tx["x"] * scale + ox), int(tx["y"] * scale + oy)),
+                          tx.get("opacity", 1.0), tx.get("blend", "normal")))
+
+    for y0 in range(0, h, band_height):
+        y1 = min(h, y0 + band_height)
+        box = (0, y0, w, y1)
+        base, base_box = utils.background_tile(bg, scale, box)
+        canvas = utils.engine.begin(base, base_box, cache=False)
+        layers = []
+        for i, ov in enumerate(scene.overlays):
+            if not ov.get("visible", True):
+                continue
+            opacity, mode = ov.get("opacity", 1.0), ov.get("blend", "normal")
+            if i in whole:
+                x, y = int(ov["x"] * scale), int(ov["y"] * scale)
+                layers.append((whole[i], (x, y), opacity, mode))
+                continue
+            rows = overlay_rows(utils, ov, scale, y0, y1)
+            if rows is not None:
+                layers.append(rows + (opacity, mode))
+        for sprite, (x, y), opacity, mode in layers + texts:
+            if x < w and y < y1 and x + sprite.width > 0 and y + sprite.height > y0:
+                utils.engine.blend(canvas, sprite, (x, y - y0), opacity, mode)
+        yield y0, np.asarray(utils.engine.finish(canvas).convert("RGB"))
+
+def _chunk(f, kind, data):
+    f.write(struct.pack(">I", len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xFFFFFFFF))
+
+def paeth_filter(band, prev):
+    # PNG filter type 4 for every row of `band`; `prev` is the row above the band.
+    cur = band.reshape(band.shape[0], -1).astype(np.int16)
+    up = np.vstack([prev.reshape(1, -1).astype(np.int16), cur[:-1]])
+    left = np.zeros_like(cur)
+    left[:, 3:] = cur[:, :-3]
+    upleft = np.zeros_like(cur)
+    upleft[:, 3:] = up[:, :-3]
+    p = left + up - upleft
+    pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - upleft)
+    pred = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+    out = np.empty((cur.shape[0], cur.shape[1] + 1), dtype=np.uint8)
+    out[:, 0] = 4
+    out[:, 1:] = (cur - pred) & 0xFF
+    return out
+
+def write_png(path, size, bands, compress_level=6):
+    w, h = size
+    deflate = zlib.compressobj(compress_level)
+    prev = np.zeros(w * 3, dtype=np.uint8)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        _chunk(f, b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+        for _, band in bands:
+            # A few rows at a time keeps the int16 filter temporaries small.
+            for r in range(0, band.shape[0], 16):
+                rows = band[r:r + 16]
+                data = deflate.compress(paeth_filter(rows, prev).tobytes())
+                prev = rows[-1]
+                if data:
+                    _chunk(f, b"IDAT", data)
+        _chunk(f, b"IDAT", deflate.flush())
+        _chunk(f, b"IEND", b"")
+
+def write_jpeg(path, size, bands, quality=92, subsampling=0):
+    w, h = size
+    fd, buf_path = tempfile.mkstemp(suffix=".rgbx", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        os.truncate(buf_path, w * h * 4)
+        mm = mmap.mmap(fd, w * h * 4)
+        buf = img = None
+        try:
+            buf = np.frombuffer(mm, dtype=np.uint8).reshape(h, w, 4)
+            for y0, band in bands:
+                buf[y0:y0 + band.shape[0], :, :3] = band
+                # Written bands are flushed so the OS can drop them (madvise is POSIX only).
+                start = y0 * w * 4 // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+                end = (y0 + band.shape[0]) * w * 4
+                mm.flush(start, end - start)
+                if hasattr(mm, "madvise") and hasattr(mmap, "MADV_DONTNEED"):
+                    page_end = end // mmap.PAGESIZE * mmap.PAGESIZE
+                    if page_end > start:
+                        mm.madvise(mmap.MADV_DONTNEED, start, page_end - start)
+            img = Image.frombuffer("RGBX", (w, h), mm, "raw", "RGBX", 0, 1)
+            img.save(path, format="JPEG", quality=quality, subsampling=subsampling)
+        finally:
+            # Every view must go before the mapping can close (and, on Windows, the file be removed).
+            buf = img = None
+            mm.close()
+    finally:
+        os.close(fd)
+        os.remove(buf_path)
+
+def stream_export(utils, scene, path, size=None, scale=None, format=None, band_height=None,
+                  band_pixels=2_000_000, progress=None, **options):
+    # `progress(fraction)` is called after every band and may raise to abort.
+    scale, out_size = output_geometry(scene.background, size, scale)
+    band_height = band_height or max(1, band_pixels // out_size[0])
+    format = (format or os.path.splitext(path)[1].lstrip(".")).upper()
+    format = "JPEG" if format == "JPG" else format
+    options = {k: v for k, v in options.items() if k in STREAM_OPTIONS.get(format, ())}
+
+    def bands():
+        for y0, band in iter_bands(utils, scene, scale, out_size, band_height):
+            yield y0, band
+            if progress:
+                progress((y0 + band.shape[0]) / out_size[1])
+    tmp = path + ".part"
+    try:
+        if format == "PNG":
+            write_png(tmp, out_size, bands(), **options)
+        elif format == "JPEG":
+            write_jpeg(tmp, out_size, bands(), **options)
+        else:
+            raise ValueError(f"Streaming export supports PNG and JPEG, not {format}")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path